@@ -1,17 +1,35 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 import datetime
+import functools
 import hashlib
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, HTTPServer
-import json
 import logging
 from optparse import OptionParser
-from typing import List
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
 import uuid
-from weakref import WeakKeyDictionary
-from scoring import get_score, get_interests
-from store import MemcacheClient
+from urllib.parse import parse_qs
+
+import codec
+import deadline
+import logqueue
+import metrics
+from ratelimit import RateLimiter
+import scoring
+from scoring import get_score, get_scores, get_interests_many
+from serde import SERDES
+from store import CircuitBreaker, HotKeys, LocalCache, MemcacheClient, parse_servers
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -21,13 +39,17 @@ BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
+TOO_MANY_REQUESTS = 429
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
+    TOO_MANY_REQUESTS: "Too Many Requests",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
     }
 UNKNOWN = 0
 MALE = 1
@@ -38,6 +60,7 @@ GENDERS = {
     FEMALE: "female",
     }
 NoneType = type(None)
+MAX_BATCH_SIZE = 1000
 
 
 class UNSET:
@@ -45,100 +68,173 @@ class UNSET:
         return False
 
 
+_UNSET = UNSET()
+
+
 class BaseField:
     def __init__(self, name: str, required: bool = False, nullable: bool = False):
         self.name = name
         self.required = required
         self.nullable = nullable
-
-        self.data = WeakKeyDictionary()
+        # checks of the whole class hierarchy are collected once, so validation is a flat loop
+        # instead of a chain of super().__set__ calls
+        self.checks = tuple(klass.__dict__["check"] for klass in reversed(type(self).__mro__)
+                            if "check" in klass.__dict__)
 
     def __get__(self, instance, owner):
-        return self.data.get(instance)
+        if instance is None:
+            return self
+        return instance.__dict__.get(self.name)
 
     def __set__(self, instance, value):
-        if not self.nullable and value is None:
-            raise ValueError(f"field '{self.name}' can not be nullable")
-        elif self.required and isinstance(value, UNSET):
-            raise ValueError(f"field '{self.name}' is required")
-
-        self.data[instance] = value if not isinstance(value, UNSET) else None
+        instance.__dict__[self.name] = self.clean(value)
+
+    def clean(self, value):
+        if value is None:
+            if not self.nullable:
+                raise ValueError(f"field '{self.name}' can not be nullable")
+            return None
+        if isinstance(value, UNSET):
+            if self.required:
+                raise ValueError(f"field '{self.name}' is required")
+            return None
+        for check in self.checks:
+            value = check(self, value)
+        return value
 
 
 class CharField(BaseField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        if not isinstance(self.data[instance], (str, NoneType)):
+    def check(self, value):
+        if not isinstance(value, str):
             raise ValueError(f"field '{self.name}' must be string")
+        return value
 
 
 class ArgumentsField(BaseField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        if not isinstance(self.data[instance], (dict, NoneType)):
+    def check(self, value):
+        if not isinstance(value, dict):
             raise ValueError(f"field '{self.name}' must be dict")
+        return value
 
 
 class EmailField(CharField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        value = self.data[instance]
-        if not isinstance(value, NoneType) and not (isinstance(value, str) and value.find("@") != -1):
+    def check(self, value):
+        if value.find("@") == -1:
             raise ValueError(f"field '{self.name}' must be string with '@'")
+        return value
 
 
 class PhoneField(BaseField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        value = self.data[instance]
-        if not isinstance(value, NoneType) and not (len(str(value)) == 11 and str(value).startswith('7')):
+    def check(self, value):
+        if not (len(str(value)) == 11 and str(value).startswith('7')):
             raise ValueError(f"field '{self.name}' must be string or integer, starts with '7' and have a length of 11")
+        return value
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_date(value: str):
+    # fast path for the canonical DD.MM.YYYY, strptime handles the rest of what '%d.%m.%Y' accepts
+    if len(value) == 10 and value[2] == value[5] == "." and \
+            value[:2].isdigit() and value[3:5].isdigit() and value[6:].isdigit():
+        return datetime.datetime(int(value[6:]), int(value[3:5]), int(value[:2]))
+    return datetime.datetime.strptime(value, '%d.%m.%Y')
 
 
 class DateField(BaseField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        if not isinstance(self.data[instance], NoneType):
-            try:
-                self.data[instance] = datetime.datetime.strptime(value, '%d.%m.%Y')
-            except (ValueError, TypeError):
-                raise ValueError(f"field '{self.name}' must be date with DD.MM.YYYY format")
+    def check(self, value):
+        try:
+            if not isinstance(value, str):
+                raise TypeError(value)
+            return parse_date(value)
+        except (ValueError, TypeError):
+            raise ValueError(f"field '{self.name}' must be date with DD.MM.YYYY format")
 
 
 class BirthDayField(DateField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        value = self.data[instance]
-        if not isinstance(value, NoneType) and (datetime.datetime.now() - value).days / 365.25 > 70:
+    # a date is too old when more than 70 * 365.25 full days have passed since it
+    max_age_days = int(70 * 365.25) + 1
+
+    def __init__(self, name: str, required: bool = False, nullable: bool = False):
+        super().__init__(name, required, nullable)
+        self.__cutoff = None
+        self.__cutoff_expires = 0.
+
+    def cutoff(self):
+        # recomputed once a day, at local midnight
+        if time.time() >= self.__cutoff_expires:
+            today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+            self.__cutoff = today - datetime.timedelta(days=self.max_age_days)
+            self.__cutoff_expires = (today + datetime.timedelta(days=1)).timestamp()
+        return self.__cutoff
+
+    def check(self, value):
+        if value <= self.cutoff():
             raise ValueError(f"field '{self.name}' must be a date that has passed no more than 70 years")
+        return value
 
 
 class GenderField(BaseField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        value = self.data[instance]
-        if not isinstance(value, NoneType) and (value not in [0, 1, 2] or not isinstance(value, int)):
+    def check(self, value):
+        if value not in [0, 1, 2] or not isinstance(value, int):
             raise ValueError(f"field '{self.name}' must be integer with value 0, 1 or 2")
+        return value
 
 
 class ClientIDsField(BaseField):
-    def __set__(self, instance, value):
-        super().__set__(instance, value)
-        if not isinstance(value, NoneType):
-            if not isinstance(value, list) or not value or not (all([isinstance(item, int) for item in value])):
-                raise ValueError(f"field '{self.name}' must be list with integers")
+    def check(self, value):
+        if not isinstance(value, list) or not value or not (all([isinstance(item, int) for item in value])):
+            raise ValueError(f"field '{self.name}' must be list with integers")
+        return value
+
+
+class ArgumentsListField(BaseField):
+    def check(self, value):
+        if not isinstance(value, list) or not value or not all(isinstance(item, dict) for item in value):
+            raise ValueError(f"field '{self.name}' must be non-empty list of dicts")
+        return value
+
+
+class RequestMeta(type):
+    # compiles the fields declared on a request class once: values are validated by a flat loop
+    # over (name, clean, setter) and stored in __slots__ instead of per-field dictionaries
+    def __new__(mcs, name, bases, namespace):
+        # fields of the bases come first, base-most first, and may be redeclared by the class
+        fields = {}
+        for base in reversed(bases):
+            for klass in reversed(base.__mro__):
+                fields.update(vars(klass).get("fields", {}))
+        inherited = set(fields)
+        own = {attr: value for attr, value in namespace.items() if isinstance(value, BaseField)}
+        for attr in own:
+            del namespace[attr]
+        fields.update(own)
+        # inherited fields already have their slots
+        namespace["__slots__"] = tuple(attr for attr in own if attr not in inherited)
+        cls = super().__new__(mcs, name, bases, namespace)
+        cls.fields = fields
+        cls.compiled_fields = tuple((attr, field.clean, getattr(cls, attr).__set__) for attr, field in fields.items())
+        return cls
+
+
+class Request(metaclass=RequestMeta):
+    def __init__(self, **values):
+        for attr in values:
+            if attr not in self.fields:
+                raise TypeError(f"{type(self).__name__}() got an unexpected keyword argument '{attr}'")
+        self.validate(values)
+        for attr, clean, setter in self.compiled_fields:
+            setter(self, clean(values.get(attr, _UNSET)))
+
+    def validate(self, values: dict):
+        pass
 
 
-class ClientsInterestsRequest:
+class ClientsInterestsRequest(Request):
     client_ids = ClientIDsField(name="client_ids", required=True)
     date = DateField(name="date", required=False, nullable=True)
 
-    def __init__(self, client_ids: List[int] = UNSET(), date: str = UNSET()):
-        self.client_ids = client_ids
-        self.date = date
-
 
-class OnlineScoreRequest:
+class OnlineScoreRequest(Request):
     first_name = CharField(name="first_name", required=False, nullable=True)
     last_name = CharField(name="last_name", required=False, nullable=True)
     email = EmailField(name="email", required=False, nullable=True)
@@ -146,18 +242,10 @@ class OnlineScoreRequest:
     birthday = BirthDayField(name="birthday", required=False, nullable=True)
     gender = GenderField(name="gender", required=False, nullable=True)
 
-    def __init__(self, first_name: str = UNSET(), last_name: str = UNSET(), email: str = UNSET(),
-                 phone: str = UNSET(), birthday: str = UNSET(), gender: str = UNSET()):
-
-        valid_pairs = [(phone, email), (first_name, last_name), (gender, birthday)]
-        if not any(map(lambda pair: not isinstance(pair[0], UNSET) and not isinstance(pair[1], UNSET), valid_pairs)):
+    def validate(self, values: dict):
+        valid_pairs = [("phone", "email"), ("first_name", "last_name"), ("gender", "birthday")]
+        if not any(first in values and second in values for first, second in valid_pairs):
             raise ValueError("Must be at least one pair of 'phone-email', 'first_name-last_name' or 'gender-birthday'")
-        self.first_name = first_name
-        self.last_name = last_name
-        self.email = email
-        self.phone = phone
-        self.birthday = birthday
-        self.gender = gender
 
     def to_dict(self, exclude_none: bool = False):
         args_ = {'first_name': self.first_name, 'last_name': self.last_name, 'email': self.email, 'phone': self.phone,
@@ -168,32 +256,67 @@ class OnlineScoreRequest:
         return args_
 
 
-class MethodRequest:
+class OnlineScoreBatchRequest(Request):
+    items = ArgumentsListField(name="items", required=True)
+
+    def __init__(self, **values):
+        super().__init__(**values)
+        if len(self.items) > MAX_BATCH_SIZE:
+            raise ValueError(f"field 'items' must contain no more than {MAX_BATCH_SIZE} requests")
+
+    def validate_items(self):
+        # per-item results with validation errors filled in, and valid requests by their position
+        results, valid = [], {}
+        for i, item in enumerate(self.items):
+            try:
+                valid[i] = OnlineScoreRequest(**item)
+                results.append(None)
+            except (ValueError, TypeError) as ex:
+                results.append({"error": str(ex)})
+        return results, valid
+
+
+class MethodRequest(Request):
     account = CharField(name="account", required=False, nullable=True)
     login = CharField(name="login", required=True, nullable=True)
     token = CharField(name="token", required=True, nullable=True)
     arguments = ArgumentsField(name="arguments", required=True, nullable=True)
     method = CharField(name="method", required=True, nullable=False)
 
-    def __init__(self, login: str = UNSET(), token: str = UNSET(), arguments: dict = UNSET(), method: str = UNSET(),
-                 account: str = UNSET()):
-        self.account = account
-        self.login = login
-        self.token = token
-        self.arguments = arguments
-        self.method = method
-
     @property
     def is_admin(self):
         return self.login == ADMIN_LOGIN
 
 
+# verified (account, login, token) triples, set to None to check every request from scratch
+AUTH_CACHE = LocalCache(max_entries=10000, ttl=24 * 60 * 60, name="auth")
+# requests per login or account, None for no limits
+RATE_LIMITER = None
+
+REQUESTS = metrics.Counter("scoring_requests_total", "Handled requests by method and response code.",
+                           ("method", "code"))
+STAGE_SECONDS = metrics.Histogram("scoring_stage_seconds", "Request processing time by stage.", ("stage",))
+SHED = metrics.Counter("scoring_requests_shed_total", "Requests answered with 503 without being handled, by reason.",
+                       ("reason",))
+
+
 def check_auth(request: MethodRequest):
+    cache = AUTH_CACHE
+    key = (request.account, request.login, request.token)
+    if cache is not None and cache.get(key):
+        return True
+
+    expire_time = None
     if request.is_admin:
-        digest = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode('utf-8')).hexdigest()
+        now = datetime.datetime.now()
+        digest = hashlib.sha512((now.strftime("%Y%m%d%H") + ADMIN_SALT).encode('utf-8')).hexdigest()
+        # admin token changes every hour
+        expire_time = 60 * 60 - now.minute * 60 - now.second - now.microsecond / 1e6
     else:
         digest = hashlib.sha512((request.account + request.login + SALT).encode('utf-8')).hexdigest()
     if digest == request.token:
+        if cache is not None:
+            cache.set(key, True, expire_time)
         return True
     return False
 
@@ -217,95 +340,573 @@ def online_score(method_request: MethodRequest, ctx, store):
     return {"score": score}, OK
 
 
+def online_score_batch(method_request: MethodRequest, ctx, store):
+    arguments_ = OnlineScoreBatchRequest(**method_request.arguments)
+    results, valid = arguments_.validate_items()
+    ctx.update({'nitems': len(results), 'nvalid': len(valid)})
+
+    if method_request.is_admin:
+        scores = [42] * len(valid)
+    else:
+        scores = get_scores(store, [request.to_dict() for request in valid.values()])
+    for i, score in zip(valid, scores):
+        results[i] = {"score": score}
+
+    return {"scores": results}, OK
+
+
 def clients_interests(method_request: MethodRequest, ctx, store):
     arguments_ = ClientsInterestsRequest(**method_request.arguments)
     ctx.update({'nclients': len(arguments_.client_ids)})
-    return {id_: get_interests(store, id_) for id_ in arguments_.client_ids}, OK
+    return get_interests_many(store, arguments_.client_ids), OK
+
+
+def rate_limited(body):
+    # runs before validation, so partners over their limit cost a couple of dict lookups; fields that
+    # validation would reject are left to it. Anyone can send a partner's login with a bad token, so
+    # only credentials check_auth has already verified are charged to their login or account bucket.
+    # The rest go through the unverified bucket of their login and return None: their own bucket is
+    # charged by login_rate_limited once check_auth accepts them
+    limiter = RATE_LIMITER
+    if limiter is None or not isinstance(body, dict):
+        return False
+    account, login, token = body.get("account"), body.get("login"), body.get("token")
+    if not isinstance(login, str) or not isinstance(account, (str, NoneType)) or not isinstance(token, str):
+        return False
+    cache = AUTH_CACHE
+    if cache is not None and cache.get((account, login, token)):
+        return not limiter.allow(account, login)
+    if not limiter.allow(account, login, verified=False):
+        return True
+    return None
+
+
+def login_rate_limited(request: MethodRequest):
+    limiter = RATE_LIMITER
+    return limiter is not None and not limiter.allow(request.account, request.login)
+
+
+def request_deadline(headers, budget=None):
+    # X-Deadline-Ms is how long the caller will wait for the answer, the server budget otherwise
+    seconds = budget
+    value = headers.get("x-deadline-ms")
+    if value is not None:
+        try:
+            seconds = float(value) / 1000
+        except ValueError:
+            pass
+    return deadline.after(seconds)
 
 
 def method_handler(request, ctx, store):
     handler_functions = {
         "online_score": online_score,
+        "online_score_batch": online_score_batch,
         "clients_interests": clients_interests
         }
 
     body = request.get("body")
     if not body:
         return None, INVALID_REQUEST
-
+    if deadline.expired():
+        SHED.inc("deadline")
+        return None, SERVICE_UNAVAILABLE
+    limited = rate_limited(body)
+    if limited:
+        return None, TOO_MANY_REQUESTS
+
+    started = time.perf_counter()
     try:
         method_request = MethodRequest(**body)
     except ValueError as ex:
-        logging.exception(ex, exc_info=True)
+        logging.info("Invalid request: %s", ex)
         return str(ex), INVALID_REQUEST
-
-    if not check_auth(method_request):
+    finally:
+        validated = time.perf_counter()
+        STAGE_SECONDS.observe(validated - started, "validate")
+    # unknown method names are not used as metric labels
+    ctx["method"] = method_request.method if method_request.method in handler_functions else "unknown"
+
+    authorized = check_auth(method_request)
+    authenticated = time.perf_counter()
+    STAGE_SECONDS.observe(authenticated - validated, "auth")
+    if not authorized:
         return None, FORBIDDEN
+    if limited is None and login_rate_limited(method_request):
+        return None, TOO_MANY_REQUESTS
 
     try:
         response, code = handler_functions[method_request.method](method_request, ctx, store)
     except ValueError as ex:
-        logging.exception(ex, exc_info=True)
+        logging.info("Invalid arguments: %s", ex)
         return str(ex), INVALID_REQUEST
+    except deadline.DeadlineExceeded:
+        SHED.inc("deadline")
+        return None, SERVICE_UNAVAILABLE
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - authenticated, "handler")
 
     return response, code
 
 
+def hot_keys_body(store, query):
+    # GET /hotkeys?limit=N: the memcache keys this worker looks up most, hottest first -> (body, code);
+    # every counted key without a limit
+    hot_keys = getattr(store, "hot_keys", None)
+    limit = parse_qs(query, keep_blank_values=True).get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit[0])
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return codec.dumps(make_response("limit must be a positive integer", BAD_REQUEST)), BAD_REQUEST
+    return codec.dumps({"keys": hot_keys.top(limit) if hot_keys is not None else []}), OK
+
+
+def make_response(response, code):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
         "method": method_handler
         }
-    store = MemcacheClient()
+    # persistent connections: idle ones are closed after `timeout` seconds,
+    # busy ones after `max_requests` requests
+    protocol_version = "HTTP/1.1"
+    timeout = 15
+    max_requests = 1000
+    # headers and body leave in a single segment
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    # share of successful requests written to the log, failed ones are always logged
+    log_sample = 1.
+    # seconds a request may take unless X-Deadline-Ms says otherwise, None for no deadline
+    budget = None
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+        # without a thread pool an idle connection would hold up every other client for `timeout`
+        self.keep_alive = bool(getattr(self.server, "threads", 0))
+
+    @property
+    def store(self):
+        return self.server.store
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/metrics":
+            body, code, content_type = metrics.render().encode('utf-8'), OK, metrics.CONTENT_TYPE
+        elif path == "/hotkeys":
+            body, code = hot_keys_body(self.store, query)
+            content_type = "application/json"
+        else:
+            return self.send_error(HTTPStatus.NOT_IMPLEMENTED, "Unsupported method (%r)" % self.command)
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if not self.keep_alive:
+            self.close_connection = True
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_POST(self):
         response, code = {}, OK
         context = {"request_id": self.get_request_id(self.headers)}
+        expires = request_deadline(self.headers, self.budget)
         request = None
+        data_string = b""
+        started = time.perf_counter()
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            request = codec.loads(data_string)
         except:
             code = BAD_REQUEST
+        STAGE_SECONDS.observe(time.perf_counter() - started, "parse")
 
         if request:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
             if path in self.router:
                 try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
+                    with deadline.scope(expires):
+                        response, code = self.router[path]({"body": request, "headers": self.headers}, context,
+                                                           self.store)
                 except Exception as e:
                     logging.exception("Unexpected error: %s" % e)
                     code = INTERNAL_ERROR
             else:
                 code = NOT_FOUND
 
+        started = time.perf_counter()
+        r = make_response(response, code)
+        try:
+            body = codec.dumps(r)
+        except (TypeError, ValueError) as e:
+            logging.exception("Unserializable response: %s" % e)
+            code = INTERNAL_ERROR
+            r = make_response(None, code)
+            body = codec.dumps(r)
+        STAGE_SECONDS.observe(time.perf_counter() - started, "serialize")
+        REQUESTS.inc(context.get("method", ""), code)
+
+        self.requests_served += 1
+        if code == BAD_REQUEST or self.requests_served >= self.max_requests or not self.keep_alive:
+            # the unread rest of a malformed request must not be taken for the next one
+            self.close_connection = True
+
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r))
+        self.wfile.write(body)
+        if code != OK or self.log_sample >= 1 or random.random() < self.log_sample:
+            context.update(r)
+            logging.info("%s: %s %s", self.path, data_string, context["request_id"])
+            logging.info(context)
+
+    def log_request(self, code="-", size="-"):
+        # do_POST logs requests itself, sampled and through the logging handlers
+        pass
+
+    def log_message(self, format, *args):
+        logging.warning("%s - %s", self.address_string(), format % args)
+
+
+def replay(source, destination, store, workers: int = 4, window: int = 1024):
+    # streams MethodRequest bodies from JSONL `source` through method_handler and writes responses
+    # to `destination` in input order, with at most `window` records in flight
+    def handle(line):
+        try:
+            request = codec.loads(line)
+        except ValueError:
+            return make_response(None, BAD_REQUEST)
+        try:
+            response, code = method_handler({"body": request, "headers": {}}, {}, store)
+        except Exception as e:
+            logging.exception("Unexpected error: %s" % e)
+            response, code = None, INTERNAL_ERROR
+        return make_response(response, code)
+
+    lines = (line for line in source if line.strip())
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for line in lines:
+            pending.append(pool.submit(handle, line))
+            if len(pending) >= window:
+                destination.write(codec.dumps(pending.popleft().result()).decode('utf-8') + "\n")
+        while pending:
+            destination.write(codec.dumps(pending.popleft().result()).decode('utf-8') + "\n")
+
+
+SHED_BODY = b'{"error": "Service Unavailable", "code": 503}'
+SHED_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                 b"Connection: close\r\nRetry-After: 1\r\n\r\n%s" % (len(SHED_BODY), SHED_BODY))
+
+
+class ScoringHTTPServer(HTTPServer):
+    def __init__(self, server_address, handler_class, threads: int = 0, store=None, max_queue: int = 0):
+        super().__init__(server_address, handler_class)
+        self.threads = threads
+        self.store = store
+        # load shedding: a connection gets a canned 503 when `max_queue` connections already wait for
+        # a thread, or when the wait estimated from the time connections hold a thread exceeds the budget
+        self.max_queue = max_queue
+        self.queued = 0
+        self.busy = 0
+        self.hold_time = 0.
+        self._lock = threading.Lock()
+        self._shed = deque()
+        self._pool = None
+
+    def process_request(self, request, client_address):
+        # the pool is created lazily, so the bound server can be shared by forked workers
+        if not self.threads:
+            return super().process_request(request, client_address)
+        reason = self.shed_reason()
+        if reason:
+            return self.shed(request, reason)
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="scoring")
+        with self._lock:
+            self.queued += 1
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+    def shed_reason(self):
+        if self.max_queue and self.queued >= self.max_queue:
+            return "queue"
+        budget = getattr(self.RequestHandlerClass, "budget", None)
+        if budget and self.busy + self.queued >= self.threads:
+            # a thread frees up every hold_time / threads seconds on average
+            if (self.queued + 1) * self.hold_time / self.threads > budget:
+                return "wait"
+        return None
+
+    def shed(self, request, reason):
+        SHED.inc(reason)
+        try:
+            request.setblocking(False)
+            request.send(SHED_RESPONSE)
+            request.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        # closing with the request unread would reset the connection under the response,
+        # the socket is closed by service_actions once the client has had time to read it
+        self._shed.append((time.monotonic() + 1, request))
+
+    def service_actions(self):
+        now = time.monotonic()
+        while self._shed and self._shed[0][0] <= now:
+            self.close_request(self._shed.popleft()[1])
+
+    def process_request_thread(self, request, client_address):
+        with self._lock:
+            self.queued -= 1
+            self.busy += 1
+        started = time.monotonic()
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._lock:
+                self.busy -= 1
+                self.hold_time += (time.monotonic() - started - self.hold_time) * .1
+
+    def server_close(self):
+        super().server_close()
+        while self._shed:
+            self.close_request(self._shed.popleft()[1])
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+def run_worker(server: ScoringHTTPServer, store_factory=MemcacheClient):
+    # every worker talks to memcache through its own client: sockets must not be shared across forks
+    server.store = store_factory()
+    # SIGTERM stops the loop so queued writes and log records are flushed below; shutdown() waits for
+    # serve_forever, which runs in this thread, so it is called from another one
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.store.close()
+
+
+def stop_workers(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def fork_workers(target, workers: int = 1):
+    if workers <= 1:
+        target()
         return
 
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                target()
+            finally:
+                # os._exit skips atexit, queued log records must be written first
+                logging.shutdown()
+                os._exit(0)
+        pids.append(pid)
+
+    # systemd and docker stop the master with SIGTERM: pass it on and wait for the workers to finish
+    previous = signal.signal(signal.SIGTERM, lambda signum, frame: stop_workers(pids))
+    try:
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except KeyboardInterrupt:
+                stop_workers(pids)
+                os.waitpid(pid, 0)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+
+def serve(server: ScoringHTTPServer, workers: int = 1, store_factory=MemcacheClient):
+    fork_workers(lambda: run_worker(server, store_factory), workers)
+    server.server_close()
+
 
 if __name__ == "__main__":
+    # modules importing `api` (async_api) must see the settings configured below, not a second copy
+    sys.modules.setdefault("api", sys.modules[__name__])
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-w", "--workers", action="store", type=int, default=1,
+                  help="number of pre-forked processes sharing the listening socket")
+    op.add_option("-t", "--threads", action="store", type=int, default=0,
+                  help="size of the request thread pool per worker, 0 serves requests in the main thread")
+    op.add_option("--async", action="store_true", dest="use_async", default=False,
+                  help="serve requests with the asyncio front end instead of MainHTTPHandler")
+    op.add_option("--memcache", action="store", default="localhost:11211",
+                  help="comma separated host:port list, keys are sharded over the nodes with consistent hashing")
+    op.add_option("--memcache-timeout", action="store", type=float, default=None,
+                  help="seconds a memcache call may take, the request budget by default (5 without a budget); "
+                       "the pooled sync client cannot cut a call short when a request runs out of time")
+    op.add_option("--memcache-pool-size", action="store", type=int, default=None,
+                  help="max connections per memcache node and worker, defaults to the thread pool size")
+    op.add_option("--memcache-idle-timeout", action="store", type=float, default=60.,
+                  help="seconds after which idle pooled connections are closed")
+    op.add_option("--memcache-chunk-size", action="store", type=int, default=100,
+                  help="max keys per memcache multi-get")
+    op.add_option("--local-cache-size", action="store", type=int, default=0,
+                  help="max scores kept in the in-process cache in front of memcache, 0 disables it")
+    op.add_option("--local-cache-memory", action="store", type=int, default=16,
+                  help="max memory of the in-process score cache, in megabytes")
+    op.add_option("--memcache-format", action="store", default="legacy", choices=sorted(SERDES),
+                  help="value encoding for writes; both formats are always readable, so switch writers to "
+                       "compact only after every reader runs this version")
+    op.add_option("--interests-cache-size", action="store", type=int, default=0,
+                  help="max client interests kept in the in-process cache, 0 disables it")
+    op.add_option("--interests-cache-ttl", action="store", type=int, default=60,
+                  help="seconds cached interests are served without asking memcache")
+    op.add_option("--interests-cache-grace", action="store", type=int, default=300,
+                  help="seconds expired interests are still served while refreshed in the background")
+    op.add_option("--interests-negative-ttl", action="store", type=int, default=30,
+                  help="seconds a client id missing in memcache is remembered as having no interests")
+    op.add_option("--hot-keys", action="store", type=int, default=0,
+                  help="memcache keys whose lookups are counted for GET /hotkeys, 0 disables counting")
+    op.add_option("--hot-keys-sample", action="store", type=float, default=.01,
+                  help="share of lookups counted for GET /hotkeys")
+    op.add_option("--no-legacy-score-keys", action="store_false", dest="legacy_score_keys", default=True,
+                  help="do not look up scores under the uid: keys written before the s2: key format")
+    op.add_option("--memcache-write-behind", action="store", type=int, default=0, metavar="QUEUE_SIZE",
+                  help="queue score writes and send them to memcache in batches from a background thread, "
+                       "0 writes on the request path")
+    op.add_option("--memcache-breaker-failures", action="store", type=int, default=5,
+                  help="consecutive failed memcache calls that open the circuit breaker")
+    op.add_option("--memcache-breaker-timeout", action="store", type=float, default=10.,
+                  help="seconds the breaker stays open before a trial call is let through")
+    op.add_option("--replay", action="store", default=None, metavar="FILE",
+                  help="process a JSONL file of method requests offline instead of serving HTTP")
+    op.add_option("--replay-output", action="store", default=None, metavar="FILE",
+                  help="JSONL file for the replay responses, stdout by default")
+    op.add_option("--auth-cache-size", action="store", type=int, default=10000,
+                  help="max verified credentials remembered per worker, 0 disables the cache")
+    op.add_option("--rate-limits", action="store", default=None, metavar="FILE",
+                  help="JSON file with request rate limits per login and account")
+    op.add_option("--rate-limit-sync", action="store_true", default=False,
+                  help="share rate limit counters between processes and hosts through memcache")
+    op.add_option("--json", action="store", default=None, choices=sorted(codec.BACKENDS),
+                  help="JSON backend, the fastest installed one by default")
+    op.add_option("--keepalive-timeout", action="store", type=float, default=15.,
+                  help="seconds an idle persistent connection is kept open")
+    op.add_option("--max-requests-per-connection", action="store", type=int, default=1000)
+    op.add_option("--request-budget", action="store", type=float, default=.1,
+                  help="seconds a request may take unless the client sends X-Deadline-Ms (milliseconds), "
+                       "0 for no deadline; requests out of time are answered with 503")
+    op.add_option("--max-queue", action="store", type=int, default=0,
+                  help="connections waiting for a thread (requests in progress with --async) beyond which "
+                       "new ones are answered with 503, 0 for no limit")
+    op.add_option("--log-queue-size", action="store", type=int, default=10000,
+                  help="log records buffered for the background writer, over it they are dropped; "
+                       "0 writes the log synchronously")
+    op.add_option("--log-sample", action="store", type=float, default=1.,
+                  help="share of successful requests written to the log")
     (opts, args) = op.parse_args()
-    logging.basicConfig(filename=opts.log, level=logging.INFO,
-                        format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
-    try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        pass
-    server.server_close()
+    log_format = {"format": '[%(asctime)s] %(levelname).1s %(message)s', "datefmt": '%Y.%m.%d %H:%M:%S'}
+    if opts.log_queue_size:
+        logqueue.setup(filename=opts.log, level=logging.INFO, max_size=opts.log_queue_size, **log_format)
+    else:
+        logging.basicConfig(filename=opts.log, level=logging.INFO, **log_format)
+    MainHTTPHandler.log_sample = opts.log_sample
+    scoring.LEGACY_KEYS = opts.legacy_score_keys
+    codec.use(opts.json)
+    AUTH_CACHE = None
+    if opts.auth_cache_size:
+        AUTH_CACHE = LocalCache(max_entries=opts.auth_cache_size, ttl=24 * 60 * 60, name="auth")
+    store_options = {
+        "timeout": opts.memcache_timeout or opts.request_budget or 5.,
+        "chunk_size": opts.memcache_chunk_size,
+        "servers": parse_servers(opts.memcache),
+        "serde": SERDES[opts.memcache_format](),
+        }
+    sync_store_options = {"pool_idle_timeout": opts.memcache_idle_timeout, "write_behind": opts.memcache_write_behind,
+                          "negative_ttl": opts.interests_negative_ttl}
+    if opts.memcache_pool_size:
+        store_options["pool_size"] = opts.memcache_pool_size
+
+    def make_breaker():
+        return CircuitBreaker(failure_threshold=opts.memcache_breaker_failures,
+                              recovery_timeout=opts.memcache_breaker_timeout)
+
+    if opts.rate_limits:
+        RATE_LIMITER = RateLimiter.from_file(
+            opts.rate_limits, store=MemcacheClient(breaker=make_breaker(), **store_options) if opts.rate_limit_sync
+            else None)
+
+    def make_hot_keys():
+        return HotKeys(max_keys=opts.hot_keys, sample=opts.hot_keys_sample) if opts.hot_keys else None
+
+    def make_read_cache():
+        if not opts.interests_cache_size:
+            return None
+        return LocalCache(max_entries=opts.interests_cache_size, ttl=opts.interests_cache_ttl,
+                          grace=opts.interests_cache_grace, name="interests")
+
+    if opts.replay:
+        store_options.setdefault("pool_size", max(opts.threads, 1))
+        store = MemcacheClient(breaker=make_breaker(), read_cache=make_read_cache(), **sync_store_options,
+                               **store_options)
+        output = open(opts.replay_output, "w") if opts.replay_output else contextlib.nullcontext(sys.stdout)
+        with open(opts.replay) as source, output as destination:
+            replay(source, destination, store, workers=max(opts.threads, 1))
+        store.close()
+    elif opts.use_async:
+        import async_api
+        from store import AsyncMemcacheClient
+
+        async_api.AsyncHTTPServer.log_sample = opts.log_sample
+        async_api.AsyncHTTPServer.budget = opts.request_budget or None
+        async_api.AsyncHTTPServer.max_queue = opts.max_queue
+
+        def async_store_factory():
+            return AsyncMemcacheClient(breaker=make_breaker(), hot_keys=make_hot_keys(), **store_options)
+
+        sock = socket.create_server(("localhost", opts.port))
+        logging.info("Starting asyncio server at %s (workers: %s)" % (opts.port, opts.workers))
+        fork_workers(lambda: async_api.run_worker(sock, async_store_factory, opts.keepalive_timeout,
+                                                  opts.max_requests_per_connection), opts.workers)
+        sock.close()
+    else:
+        store_options.setdefault("pool_size", max(opts.threads, 1))
+
+        def store_factory():
+            local_cache = None
+            if opts.local_cache_size:
+                local_cache = LocalCache(max_entries=opts.local_cache_size,
+                                         max_bytes=opts.local_cache_memory * 2 ** 20, name="memcache")
+            return MemcacheClient(local_cache=local_cache, breaker=make_breaker(), read_cache=make_read_cache(),
+                                  hot_keys=make_hot_keys(), **sync_store_options, **store_options)
+
+        MainHTTPHandler.timeout = opts.keepalive_timeout
+        MainHTTPHandler.max_requests = opts.max_requests_per_connection
+        MainHTTPHandler.budget = opts.request_budget or None
+        server = ScoringHTTPServer(("localhost", opts.port), MainHTTPHandler, threads=opts.threads,
+                                   max_queue=opts.max_queue)
+        logging.info("Starting server at %s (workers: %s, threads: %s)" % (opts.port, opts.workers, opts.threads))
+        serve(server, workers=opts.workers, store_factory=store_factory)
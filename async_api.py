@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+from http import HTTPStatus
+import logging
+import random
+import signal
+import socket
+import time
+import uuid
+
+import codec
+import deadline
+import metrics
+from api import (OK, BAD_REQUEST, FORBIDDEN, NOT_FOUND, INVALID_REQUEST, TOO_MANY_REQUESTS, INTERNAL_ERROR,
+                 SERVICE_UNAVAILABLE, REQUESTS, SHED, STAGE_SECONDS, ClientsInterestsRequest, MethodRequest,
+                 OnlineScoreBatchRequest, OnlineScoreRequest, check_auth, hot_keys_body, login_rate_limited,
+                 make_response, rate_limited, request_deadline)
+from scoring import get_score_async, get_scores_async, get_interests_many_async
+from store import AsyncMemcacheClient
+
+NOT_IMPLEMENTED = 501
+
+
+async def online_score(method_request: MethodRequest, ctx, store):
+    arguments_ = OnlineScoreRequest(**method_request.arguments)
+
+    ctx.update({'has': list(arguments_.to_dict(exclude_none=True))})
+
+    if method_request.is_admin:
+        return {"score": 42}, OK
+
+    score = await get_score_async(store=store,
+                                  phone=arguments_.phone,
+                                  email=arguments_.email,
+                                  birthday=arguments_.birthday,
+                                  gender=arguments_.gender,
+                                  first_name=arguments_.first_name,
+                                  last_name=arguments_.last_name)
+
+    return {"score": score}, OK
+
+
+async def online_score_batch(method_request: MethodRequest, ctx, store):
+    arguments_ = OnlineScoreBatchRequest(**method_request.arguments)
+    results, valid = arguments_.validate_items()
+    ctx.update({'nitems': len(results), 'nvalid': len(valid)})
+
+    if method_request.is_admin:
+        scores = [42] * len(valid)
+    else:
+        scores = await get_scores_async(store, [request.to_dict() for request in valid.values()])
+    for i, score in zip(valid, scores):
+        results[i] = {"score": score}
+
+    return {"scores": results}, OK
+
+
+async def clients_interests(method_request: MethodRequest, ctx, store):
+    arguments_ = ClientsInterestsRequest(**method_request.arguments)
+    ctx.update({'nclients': len(arguments_.client_ids)})
+    return await get_interests_many_async(store, arguments_.client_ids), OK
+
+
+async def method_handler(request, ctx, store):
+    handler_functions = {
+        "online_score": online_score,
+        "online_score_batch": online_score_batch,
+        "clients_interests": clients_interests
+        }
+
+    body = request.get("body")
+    if not body:
+        return None, INVALID_REQUEST
+    if deadline.expired():
+        SHED.inc("deadline")
+        return None, SERVICE_UNAVAILABLE
+    limited = rate_limited(body)
+    if limited:
+        return None, TOO_MANY_REQUESTS
+
+    started = time.perf_counter()
+    try:
+        method_request = MethodRequest(**body)
+    except ValueError as ex:
+        logging.info("Invalid request: %s", ex)
+        return str(ex), INVALID_REQUEST
+    finally:
+        validated = time.perf_counter()
+        STAGE_SECONDS.observe(validated - started, "validate")
+    ctx["method"] = method_request.method if method_request.method in handler_functions else "unknown"
+
+    authorized = check_auth(method_request)
+    authenticated = time.perf_counter()
+    STAGE_SECONDS.observe(authenticated - validated, "auth")
+    if not authorized:
+        return None, FORBIDDEN
+    if limited is None and login_rate_limited(method_request):
+        return None, TOO_MANY_REQUESTS
+
+    try:
+        response, code = await handler_functions[method_request.method](method_request, ctx, store)
+    except ValueError as ex:
+        logging.info("Invalid arguments: %s", ex)
+        return str(ex), INVALID_REQUEST
+    except deadline.DeadlineExceeded:
+        SHED.inc("deadline")
+        return None, SERVICE_UNAVAILABLE
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - authenticated, "handler")
+
+    return response, code
+
+
+class AsyncHTTPServer:
+    router = {
+        "method": method_handler
+        }
+    # share of successful requests written to the log, failed ones are always logged
+    log_sample = 1.
+    # seconds a request may take unless X-Deadline-Ms says otherwise, None for no deadline
+    budget = None
+    # requests handled at once beyond which new ones get a 503, 0 for no limit
+    max_queue = 0
+
+    def __init__(self, store, timeout=15, max_requests=1000):
+        self.store = store
+        self.timeout = timeout
+        self.max_requests = max_requests
+        self.in_flight = 0
+
+    def get_request_id(self, headers):
+        return headers.get('http_x_request_id', uuid.uuid4().hex)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        served = 0
+        try:
+            while await self.handle_request(reader, writer, served + 1 < self.max_requests):
+                served += 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, reuse=True):
+        # an idle keep-alive connection is dropped after timeout seconds
+        request_line = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not request_line:
+            return False
+        try:
+            command, path, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self.send(writer, BAD_REQUEST, make_response(None, BAD_REQUEST), keep_alive=False)
+            return False
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = reuse and (connection == "keep-alive" if version == "HTTP/1.0" else connection != "close")
+
+        data_string = b""
+        if "content-length" in headers:
+            try:
+                data_string = await reader.readexactly(int(headers["content-length"]))
+            except ValueError:
+                await self.send(writer, BAD_REQUEST, make_response(None, BAD_REQUEST), keep_alive=False)
+                return False
+
+        route, _, query = path.partition("?")
+        if command == "GET" and route in ("/metrics", "/hotkeys"):
+            if route == "/metrics":
+                body, code, content_type = metrics.render().encode('utf-8'), OK, metrics.CONTENT_TYPE
+            else:
+                body, code = hot_keys_body(self.store, query)
+                content_type = "application/json"
+            writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n%s"
+                         % (code, HTTPStatus(code).phrase.encode('latin-1'), content_type.encode('ascii'), len(body),
+                            b"keep-alive" if keep_alive else b"close", body))
+            await writer.drain()
+            return keep_alive
+
+        if command != "POST":
+            await self.send(writer, NOT_IMPLEMENTED, {"error": "Unsupported method (%r)" % command,
+                                                      "code": NOT_IMPLEMENTED}, keep_alive)
+            return keep_alive
+
+        if self.max_queue and self.in_flight >= self.max_queue:
+            SHED.inc("queue")
+            await self.send(writer, SERVICE_UNAVAILABLE, make_response(None, SERVICE_UNAVAILABLE), keep_alive)
+            return keep_alive
+
+        context = {"request_id": self.get_request_id(headers)}
+        expires = request_deadline(headers, self.budget)
+        self.in_flight += 1
+        try:
+            response, code = await self.dispatch(path, headers, data_string, context, expires)
+        finally:
+            self.in_flight -= 1
+        code = await self.send(writer, code, make_response(response, code), keep_alive)
+        REQUESTS.inc(context.get("method", ""), code)
+        return keep_alive
+
+    async def dispatch(self, path, headers, data_string, context, expires):
+        response, code = {}, OK
+        request = None
+        started = time.perf_counter()
+        try:
+            request = codec.loads(data_string)
+        except ValueError:
+            code = BAD_REQUEST
+        STAGE_SECONDS.observe(time.perf_counter() - started, "parse")
+
+        if request:
+            route = path.strip("/")
+            if route in self.router:
+                try:
+                    with deadline.scope(expires):
+                        response, code = await self.router[route]({"body": request, "headers": headers}, context,
+                                                                  self.store)
+                except Exception as e:
+                    logging.exception("Unexpected error: %s" % e)
+                    code = INTERNAL_ERROR
+            else:
+                code = NOT_FOUND
+
+        if code != OK or self.log_sample >= 1 or random.random() < self.log_sample:
+            context.update(make_response(response, code))
+            logging.info("%s: %s %s", path, data_string, context["request_id"])
+            logging.info(context)
+        return response, code
+
+    async def send(self, writer: asyncio.StreamWriter, code, payload, keep_alive):
+        started = time.perf_counter()
+        try:
+            body = codec.dumps(payload)
+        except (TypeError, ValueError) as e:
+            logging.exception("Unserializable response: %s" % e)
+            code = INTERNAL_ERROR
+            body = codec.dumps(make_response(None, code))
+        STAGE_SECONDS.observe(time.perf_counter() - started, "serialize")
+        writer.write(b"HTTP/1.1 %d %s\r\n"
+                     b"Content-Type: application/json\r\n"
+                     b"Content-Length: %d\r\n"
+                     b"Connection: %s\r\n\r\n%s" % (code, HTTPStatus(code).phrase.encode('latin-1'), len(body),
+                                                    b"keep-alive" if keep_alive else b"close", body))
+        await writer.drain()
+        return code
+
+
+async def serve(sock: socket.socket, store=None, timeout=15, max_requests=1000, stop: asyncio.Event = None):
+    # serves until `stop` is set, forever without one
+    store = store or AsyncMemcacheClient()
+    server = await asyncio.start_server(AsyncHTTPServer(store, timeout, max_requests).handle_connection, sock=sock)
+    try:
+        async with server:
+            if stop is None:
+                await server.serve_forever()
+            else:
+                await stop.wait()
+    finally:
+        await store.close()
+
+
+def run_worker(sock: socket.socket, store_factory=AsyncMemcacheClient, timeout=15, max_requests=1000):
+    async def main():
+        # the client is created inside the worker's event loop; SIGTERM lets serve close it
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await serve(sock, store_factory(), timeout, max_requests, stop)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
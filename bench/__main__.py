@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench [--duration SECONDS] [--output FILE]
+# runs every suite, the JSON output of two commits can be diffed with bench.compare
+
+import logging
+from optparse import OptionParser
+
+from bench import auth, bulk, codec, keepalive, keys, load, logs, serde, stages
+from bench.common import report
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    results = {}
+    for suite in (stages, auth, codec, serde, keys, bulk, keepalive, logs):
+        results.update(suite.run(opts.duration))
+    results.update(load.run(opts.duration * 5))
+    report(results, opts.output)
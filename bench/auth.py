@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.auth [--duration SECONDS] [--output FILE]
+
+import datetime
+import hashlib
+from optparse import OptionParser
+
+import api
+from bench.common import measure, report
+
+
+def make_requests():
+    user = api.MethodRequest(account="horns&hoofs", login="h&f", method="online_score", arguments={},
+                             token=hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest())
+    admin_token = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).encode()).hexdigest()
+    admin = api.MethodRequest(account="horns&hoofs", login=api.ADMIN_LOGIN, method="online_score", arguments={},
+                              token=admin_token)
+    return user, admin
+
+
+def run(duration: float):
+    user, admin = make_requests()
+    results = {}
+    cache = api.AUTH_CACHE
+    try:
+        for cached in (False, True):
+            api.AUTH_CACHE = api.LocalCache(max_entries=10000) if cached else None
+            suffix = "cached" if cached else "uncached"
+            results[f"check_auth.user.{suffix}"] = measure(lambda: api.check_auth(user), duration)
+            results[f"check_auth.admin.{suffix}"] = measure(lambda: api.check_auth(admin), duration)
+    finally:
+        api.AUTH_CACHE = cache
+    return results
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    report(run(opts.duration), opts.output)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.bulk [--duration SECONDS] [--rows N] [--output FILE]
+# rows scored per second: request by request as online_score does, and by the numpy scorer from
+# lists of strings, from numpy arrays and from CSV text
+
+import io
+import random
+from optparse import OptionParser
+
+import api
+import bulk
+from bench.common import measure, report
+from scoring import compute_score
+
+CELLS = {
+    "first_name": ["", "Стансилав"],
+    "last_name": ["", "Ступников"],
+    "email": ["", "stupnikov@otus.ru"],
+    "phone": ["", "79175002040"],
+    "birthday": ["", "01.01.1990", "29.02.2000"],
+    "gender": ["", "0", "1", "2"],
+    }
+
+
+def make_columns(rows: int):
+    rnd = random.Random(0)
+    return {field: [rnd.choice(cells) for _ in range(rows)] for field, cells in CELLS.items()}
+
+
+def score_rows(columns):
+    # the per-request path: validation by OnlineScoreRequest, then compute_score
+    scores = []
+    for values in zip(*columns.values()):
+        values = {field: value for field, value in zip(columns, values) if value != ""}
+        if "gender" in values:
+            values["gender"] = int(values["gender"])
+        try:
+            request = api.OnlineScoreRequest(**values)
+        except ValueError:
+            scores.append(None)
+            continue
+        scores.append(compute_score(request.phone, request.email, request.birthday, request.gender,
+                                    request.first_name, request.last_name))
+    return scores
+
+
+def rows_per_sec(result, rows):
+    return dict(result, ops_per_sec=round(result["ops_per_sec"] * rows, 1))
+
+
+def run(duration: float, rows: int = 10000):
+    if bulk.np is None:
+        return {}
+    columns = make_columns(rows)
+    arrays = {field: bulk.np.asarray(column, dtype=str) for field, column in columns.items()}
+    text = "\n".join([",".join(columns)] + [",".join(values) for values in zip(*columns.values())])
+    return {
+        "bulk.rows.per_request": rows_per_sec(measure(lambda: score_rows(columns), duration, batch=1), rows),
+        "bulk.rows.numpy.lists": rows_per_sec(measure(lambda: bulk.score_columns(columns), duration, batch=1), rows),
+        "bulk.rows.numpy.arrays": rows_per_sec(measure(lambda: bulk.score_columns(arrays), duration, batch=1), rows),
+        "bulk.rows.numpy.csv": rows_per_sec(measure(lambda: bulk.run(io.StringIO(text), io.StringIO(), rows),
+                                                    duration, batch=1), rows),
+        }
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-r", "--rows", action="store", type=int, default=10000, help="rows per chunk")
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    report(run(opts.duration, opts.rows), opts.output)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.codec [--duration SECONDS] [--output FILE]
+
+import hashlib
+import json
+from optparse import OptionParser
+
+import codec
+from bench.common import measure, report
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
+
+def make_payloads(nclients: int = 100):
+    online_score = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                    "token": hashlib.sha512(b"horns&hoofsh&fOtus").hexdigest(),
+                    "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "Стансилав",
+                                  "last_name": "Ступников", "birthday": "01.01.1990", "gender": 1}}
+    clients_interests = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                         "token": online_score["token"],
+                         "arguments": {"client_ids": list(range(nclients)), "date": "20.07.2017"}}
+    return {
+        "online_score.request": json.dumps(online_score).encode('utf-8'),
+        "online_score.response": {"response": {"score": 5.0}, "code": 200},
+        "clients_interests.request": json.dumps(clients_interests).encode('utf-8'),
+        "clients_interests.response": {"response": {i: INTERESTS[i % 5:i % 5 + 3] for i in range(nclients)},
+                                       "code": 200},
+        }
+
+
+def run(duration: float):
+    payloads = make_payloads()
+    results = {}
+    try:
+        for backend in codec.BACKENDS:
+            codec.use(backend)
+            for name, payload in payloads.items():
+                if name.endswith(".request"):
+                    results[f"codec.{backend}.loads.{name}"] = measure(lambda: codec.loads(payload), duration)
+                else:
+                    results[f"codec.{backend}.dumps.{name}"] = measure(lambda: codec.dumps(payload), duration)
+    finally:
+        codec.use()
+    return results
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    report(run(opts.duration), opts.output)
@@ -0,0 +1,50 @@
+import json
+import statistics
+import sys
+import time
+
+import api
+
+
+class QuietHandler(api.MainHTTPHandler):
+    # per-request access lines would dominate a benchmark run
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(func, duration: float = 1., batch: int = 100):
+    # calls func in batches until `duration` seconds have passed
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            func()
+        calls += batch
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            return {"calls": calls, "seconds": round(elapsed, 3), "ops_per_sec": round(calls / elapsed, 1)}
+
+
+def summarize(latencies: list, elapsed: float):
+    # throughput and latency percentiles (ms) for per-call latencies in seconds
+    result = {"calls": len(latencies), "seconds": round(elapsed, 3),
+              "ops_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.}
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        for p in (50, 95, 99):
+            result[f"p{p}_ms"] = round(quantiles[p - 1] * 1000, 3)
+    return result
+
+
+def report(results: dict, output=None):
+    width = max(map(len, results))
+    for name, result in results.items():
+        line = f"{name:<{width}}  {result['ops_per_sec']:>14,.1f} ops/s"
+        if "bytes" in result:
+            line += f"  {result['bytes']:>6} bytes"
+        if "p50_ms" in result:
+            line += "  p50 {p50_ms:.3f} ms  p95 {p95_ms:.3f} ms  p99 {p99_ms:.3f} ms".format(**result)
+        print(line, file=sys.stderr)
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.compare BASELINE.json CURRENT.json
+
+import json
+from optparse import OptionParser
+
+
+def compare(baseline: dict, current: dict):
+    # relative change of throughput and tail latency per benchmark present in both runs
+    rows = []
+    for name in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[name], current[name]
+        row = [name, before["ops_per_sec"], after["ops_per_sec"],
+               (after["ops_per_sec"] / before["ops_per_sec"] - 1) * 100 if before["ops_per_sec"] else 0.]
+        if "p99_ms" in before and "p99_ms" in after:
+            row.append((before["p99_ms"], after["p99_ms"]))
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog BASELINE.json CURRENT.json")
+    (opts, args) = op.parse_args()
+    if len(args) != 2:
+        op.error("two result files are required")
+    with open(args[0]) as f, open(args[1]) as g:
+        rows = compare(json.load(f), json.load(g))
+    width = max((len(row[0]) for row in rows), default=0)
+    for name, before, after, change, *latency in rows:
+        line = f"{name:<{width}}  {before:>14,.1f} -> {after:>14,.1f} ops/s  {change:+7.1f}%"
+        if latency:
+            line += "  p99 {:.3f} -> {:.3f} ms".format(*latency[0])
+        print(line)
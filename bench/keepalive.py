@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.keepalive [--duration SECONDS] [--threads N] [--output FILE]
+
+import datetime
+import hashlib
+import http.client
+import json
+from optparse import OptionParser
+import threading
+
+import api
+from bench.common import QuietHandler, measure, report
+
+
+def make_body():
+    # admin requests are answered without touching memcache
+    token = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT).encode()).hexdigest()
+    return json.dumps({"account": "horns&hoofs", "login": api.ADMIN_LOGIN, "method": "online_score",
+                       "token": token, "arguments": {"phone": "79175002040", "email": "a@b.ru"}})
+
+
+def run(duration: float, threads: int = 4):
+    server = api.ScoringHTTPServer(("localhost", 0), QuietHandler, threads=threads)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_address[1]
+    body = make_body()
+
+    def post(conn):
+        conn.request("POST", "/method", body=body)
+        conn.getresponse().read()
+
+    def new_connection():
+        conn = http.client.HTTPConnection("localhost", port)
+        post(conn)
+        conn.close()
+
+    persistent = http.client.HTTPConnection("localhost", port)
+    try:
+        return {
+            "keepalive.online_score.new_connection": measure(new_connection, duration, batch=10),
+            "keepalive.online_score.persistent": measure(lambda: post(persistent), duration, batch=10),
+            }
+    finally:
+        persistent.close()
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-t", "--threads", action="store", type=int, default=4)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    report(run(opts.duration, opts.threads), opts.output)
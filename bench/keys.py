@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.keys [--duration SECONDS] [--output FILE]
+
+import datetime
+from optparse import OptionParser
+
+from bench.common import measure, report
+from scoring import legacy_score_key, score_key
+
+FIELDS = {"phone": "79175002040", "email": "stupnikov@otus.ru", "birthday": datetime.date(1990, 1, 1), "gender": 1,
+          "first_name": "Стансилав", "last_name": "Ступников"}
+
+
+def run(duration: float):
+    legacy_fields = {name: FIELDS[name] for name in ("phone", "birthday", "first_name", "last_name")}
+    return {
+        "keys.legacy": measure(lambda: legacy_score_key(**legacy_fields), duration),
+        "keys.s2": measure(lambda: score_key(**FIELDS), duration),
+        "keys.s2.phone_only": measure(lambda: score_key(phone=FIELDS["phone"]), duration),
+        }
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    report(run(opts.duration), opts.output)
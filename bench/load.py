@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.load [--duration SECONDS] [--clients N] [--threads N] [--mix FRACTION]
+#                             [--fanout N] [--hit-rate FRACTION] [--population N] [--write-behind N]
+#                             [--interests-cache N] [--output FILE]
+
+import hashlib
+import http.client
+import itertools
+import json
+import logging
+from optparse import OptionParser
+import random
+import threading
+import time
+
+import api
+from bench.common import QuietHandler, report, summarize
+from bench.memcache import MemcacheStub
+from scoring import interests_key, score_key
+from store import LocalCache, MemcacheClient
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+TOKEN = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode('utf-8')).hexdigest()
+
+
+class Traffic:
+    # synthetic requests: `mix` is the share of online_score, `hit_rate` the share of scores and client ids
+    # found in memcache; misses use ids never seen before, so the rate holds however long the run is
+    def __init__(self, mix: float = .5, fanout: int = 10, hit_rate: float = .9, population: int = 10000):
+        self.mix = mix
+        self.fanout = fanout
+        self.hit_rate = hit_rate
+        self.population = population
+        self.fresh = itertools.count(population)
+
+    @staticmethod
+    def phone(n):
+        return "7%010d" % n
+
+    def populate(self, store):
+        scores = {score_key(phone=self.phone(n), email="stupnikov@otus.ru"): 3.0 for n in range(self.population)}
+        interests = {interests_key(n): json.dumps(INTERESTS[n % 5:n % 5 + 3]) for n in range(self.population)}
+        for values in (scores, interests):
+            store.cache_set_many(values, 60 * 60)
+
+    def pick(self, rnd: random.Random):
+        return rnd.randrange(self.population) if rnd.random() < self.hit_rate else next(self.fresh)
+
+    def request(self, rnd: random.Random):
+        if rnd.random() < self.mix:
+            method = "online_score"
+            arguments = {"phone": self.phone(self.pick(rnd)), "email": "stupnikov@otus.ru"}
+        else:
+            method = "clients_interests"
+            arguments = {"client_ids": [self.pick(rnd) for _ in range(self.fanout)], "date": "20.07.2017"}
+        body = {"account": "horns&hoofs", "login": "h&f", "method": method, "token": TOKEN, "arguments": arguments}
+        return method, json.dumps(body)
+
+
+def client(port, traffic, deadline, seed, latencies, errors):
+    rnd = random.Random(seed)
+    conn = http.client.HTTPConnection("localhost", port, timeout=10)
+    try:
+        while time.perf_counter() < deadline:
+            method, body = traffic.request(rnd)
+            started = time.perf_counter()
+            conn.request("POST", "/method", body=body)
+            response = conn.getresponse()
+            payload = response.read()
+            latencies[method].append(time.perf_counter() - started)
+            if response.status != api.OK or json.loads(payload)["code"] != api.OK:
+                errors[method] += 1
+    finally:
+        conn.close()
+
+
+def run(duration: float, clients: int = 8, threads: int = 8, write_behind: int = 0, interests_cache: int = 0,
+        **traffic_options):
+    traffic = Traffic(**traffic_options)
+    methods = ("online_score", "clients_interests")
+    latencies = {method: [] for method in methods}
+    errors = dict.fromkeys(methods, 0)
+
+    with MemcacheStub() as memcache:
+        read_cache = LocalCache(max_entries=interests_cache, ttl=60, grace=300) if interests_cache else None
+        store = MemcacheClient(timeout=1., servers=[memcache.address], pool_size=threads, write_behind=write_behind,
+                               read_cache=read_cache)
+        traffic.populate(store)
+        store.flush()
+        server = api.ScoringHTTPServer(("localhost", 0), QuietHandler, threads=threads, store=store)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started = time.perf_counter()
+        workers = [threading.Thread(target=client, args=(server.server_address[1], traffic, started + duration,
+                                                         seed, latencies, errors))
+                   for seed in range(clients)]
+        try:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            elapsed = time.perf_counter() - started
+            server.shutdown()
+            server.server_close()
+            store.close()
+
+    results = {}
+    for method in methods:
+        results[f"load.{method}"] = dict(summarize(latencies[method], elapsed), errors=errors[method])
+    results["load.total"] = dict(summarize(latencies["online_score"] + latencies["clients_interests"], elapsed),
+                                 errors=sum(errors.values()))
+    return results
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=5.)
+    op.add_option("-c", "--clients", action="store", type=int, default=8, help="concurrent keep-alive clients")
+    op.add_option("-t", "--threads", action="store", type=int, default=8, help="server thread pool size")
+    op.add_option("--mix", action="store", type=float, default=.5, help="share of online_score requests")
+    op.add_option("--fanout", action="store", type=int, default=10, help="client ids per clients_interests")
+    op.add_option("--hit-rate", action="store", type=float, default=.9)
+    op.add_option("--write-behind", action="store", type=int, default=0, help="MemcacheClient write-behind queue")
+    op.add_option("--interests-cache", action="store", type=int, default=0, help="in-process interests cache size")
+    op.add_option("--population", action="store", type=int, default=10000, help="keys preloaded into memcache")
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    report(run(opts.duration, opts.clients, opts.threads, opts.write_behind, opts.interests_cache, mix=opts.mix,
+               fanout=opts.fanout, hit_rate=opts.hit_rate, population=opts.population), opts.output)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.logs [--duration SECONDS] [--output FILE]
+
+import logging
+from optparse import OptionParser
+import tempfile
+
+import logqueue
+from bench.common import measure, report
+
+CONTEXT = {"request_id": "c414912a8fd0498788347ee6faa01e40", "method": "online_score", "has": ["phone", "email"],
+           "response": {"score": 3.0}, "code": 200}
+
+
+def run(duration: float):
+    results = {}
+    with tempfile.NamedTemporaryFile("a") as f:
+        handlers = {"file": logging.FileHandler(f.name),
+                    "queue": logqueue.QueueHandler(open(f.name, "a"), max_size=100000)}
+        for name, handler in handlers.items():
+            handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname).1s %(message)s'))
+            logger = logging.Logger("bench." + name)
+            logger.addHandler(handler)
+            results[f"log.{name}"] = measure(lambda: logger.info(CONTEXT), duration)
+            handler.close()
+        results["log.queue"]["dropped"] = handlers["queue"].dropped
+    return results
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    report(run(opts.duration), opts.output)
@@ -0,0 +1,90 @@
+import socketserver
+import threading
+import time
+
+
+class MemcacheStub(socketserver.ThreadingTCPServer):
+    # in-process stand-in for memcached speaking the subset of the text protocol used by the clients
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("localhost", 0), MemcacheStubHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self.server_address[:2]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class MemcacheStubHandler(socketserver.StreamRequestHandler):
+    # replies are written in pieces, with Nagle each one would wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, *args = line.split()
+            if command in (b"get", b"gets"):
+                self.handle_get(args)
+            elif command in (b"set", b"add"):
+                self.handle_store(command, args)
+            elif command == b"delete":
+                self.handle_delete(args)
+            elif command == b"incr":
+                self.handle_incr(args)
+            else:
+                self.wfile.write(b"ERROR\r\n")
+
+    def handle_get(self, keys):
+        with self.server.lock:
+            found = [(key, self.server.data.get(key)) for key in keys]
+        for key, item in found:
+            if item is None:
+                continue
+            flags, value, expire_at = item
+            if expire_at and expire_at < time.time():
+                continue
+            self.wfile.write(b"VALUE %s %d %d\r\n%s\r\n" % (key, flags, len(value), value))
+        self.wfile.write(b"END\r\n")
+
+    def handle_store(self, command, args):
+        key, flags, expire, size = args[:4]
+        value = self.rfile.read(int(size) + 2)[:-2]
+        expire_at = time.time() + int(expire) if int(expire) else 0
+        with self.server.lock:
+            stored = command == b"set" or key not in self.server.data
+            if stored:
+                self.server.data[key] = (int(flags), value, expire_at)
+        if b"noreply" not in args:
+            self.wfile.write(b"STORED\r\n" if stored else b"NOT_STORED\r\n")
+
+    def handle_delete(self, args):
+        with self.server.lock:
+            deleted = self.server.data.pop(args[0], None) is not None
+        if b"noreply" not in args:
+            self.wfile.write(b"DELETED\r\n" if deleted else b"NOT_FOUND\r\n")
+
+    def handle_incr(self, args):
+        key, delta = args[:2]
+        with self.server.lock:
+            item = self.server.data.get(key)
+            if item is not None and (not item[2] or item[2] >= time.time()):
+                value = b"%d" % (int(item[1]) + int(delta))
+                self.server.data[key] = (item[0], value, item[2])
+            else:
+                value = None
+        if b"noreply" not in args:
+            self.wfile.write(b"NOT_FOUND\r\n" if value is None else value + b"\r\n")
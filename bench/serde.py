@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.serde [--duration SECONDS] [--output FILE]
+
+import json
+from optparse import OptionParser
+
+import serde
+from bench.common import measure, report
+
+
+def make_values():
+    vocabulary = serde.VOCABULARIES[serde.VERSION]
+    values = {f"interests.{n}": [vocabulary[i % len(vocabulary)] for i in range(n)] for n in (3, 20, 100)}
+    values["interests.unknown_words"] = ["interest%s" % i for i in range(20)]
+    values["score"] = 3.5
+    return values
+
+
+def run(duration: float):
+    results = {}
+    serdes = {"legacy": serde.LegacySerde(), "compact": serde.CompactSerde()}
+    for name, value in make_values().items():
+        for serde_name, impl in serdes.items():
+            if serde_name == "legacy":
+                # what the clients stored before: JSON for interests, str() for scores
+                stored = (json.dumps(value) if isinstance(value, list) else str(value)).encode('utf-8')
+                decode = json.loads if isinstance(value, list) else float
+                result = measure(lambda: decode(impl.deserialize(b"key", stored, 0)), duration)
+            else:
+                stored, flags = impl.serialize(b"key", value)
+                result = measure(lambda: impl.deserialize(b"key", stored, flags), duration)
+            result["bytes"] = len(stored)
+            results[f"serde.{serde_name}.decode.{name}"] = result
+    return results
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    report(run(opts.duration), opts.output)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python -m bench.stages [--duration SECONDS] [--output FILE]
+
+import itertools
+import json
+import logging
+from optparse import OptionParser
+
+import api
+from bench.common import measure, report
+from bench.load import INTERESTS, TOKEN
+from bench.memcache import MemcacheStub
+from ratelimit import RateLimiter
+from scoring import get_interests, get_interests_many, get_score, interests_key, score_key
+from store import MemcacheClient
+
+
+class DictStore:
+    # in-process store, isolates the cost of the service code from the memcache round trip
+    def __init__(self):
+        self.data = {}
+
+    def cache_get(self, key):
+        return self.data.get(key)
+
+    get = cache_get
+
+    def get_many(self, keys):
+        return {key: self.data[key] for key in keys if key in self.data}
+
+    def cache_set(self, key, value, expire_time=60):
+        self.data[key] = value
+
+    def cache_set_many(self, values, expire_time=60):
+        self.data.update(values)
+        return []
+
+
+def request_stages(duration: float):
+    body = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": TOKEN,
+            "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "Стансилав",
+                          "last_name": "Ступников", "birthday": "01.01.1990", "gender": 1}}
+    method_request = api.MethodRequest(**body)
+    limiter = RateLimiter({"default": {"rate": 10 ** 9}})
+    results = {
+        "stage.method_request": measure(lambda: api.MethodRequest(**body), duration),
+        "stage.online_score_request": measure(lambda: api.OnlineScoreRequest(**body["arguments"]), duration),
+        "stage.check_auth": measure(lambda: api.check_auth(method_request), duration),
+        "stage.rate_limit": measure(lambda: limiter.allow(body["account"], body["login"]), duration),
+        }
+    # the whole cost of a request over its limit
+    saved, api.RATE_LIMITER = api.RATE_LIMITER, RateLimiter({"default": {"rate": 0}})
+    try:
+        results["stage.rate_limited_request"] = measure(lambda: api.method_handler({"body": body, "headers": {}}, {},
+                                                                                   None), duration)
+    finally:
+        api.RATE_LIMITER = saved
+    return results
+
+
+def store_stages(store, name: str, duration: float, fanout: int = 10):
+    store.cache_set_many({score_key(phone="79175002040"): 3.0}, 60 * 60)
+    store.cache_set_many({interests_key(cid): json.dumps(INTERESTS[cid % 5:cid % 5 + 3]) for cid in range(fanout)},
+                         60 * 60)
+    # every miss uses a phone number never scored before
+    phones = ("7%010d" % n for n in itertools.count(10 ** 9))
+    return {
+        f"stage.{name}.get_score.hit": measure(lambda: get_score(store, phone="79175002040"), duration),
+        f"stage.{name}.get_score.miss": measure(lambda: get_score(store, phone=next(phones)), duration),
+        f"stage.{name}.get_interests.hit": measure(lambda: get_interests(store, 1), duration),
+        f"stage.{name}.get_interests.miss": measure(lambda: get_interests(store, -1), duration),
+        f"stage.{name}.get_interests_many.{fanout}": measure(lambda: get_interests_many(store, range(fanout)),
+                                                             duration),
+        }
+
+
+def run(duration: float):
+    results = request_stages(duration)
+    results.update(store_stages(DictStore(), "dict", duration))
+    with MemcacheStub() as memcache:
+        store = MemcacheClient(timeout=1., servers=[memcache.address])
+        try:
+            results.update(store_stages(store, "memcache", duration))
+        finally:
+            store.close()
+    return results
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-d", "--duration", action="store", type=float, default=1.)
+    op.add_option("-o", "--output", action="store", default=None, help="write results as JSON")
+    (opts, args) = op.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    report(run(opts.duration), opts.output)
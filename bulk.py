@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python bulk.py --input requests.csv [--output scores.csv] [--chunk-size N]
+#                       [--memcache HOST:PORT,...] [--push]
+#
+# scores a CSV of OnlineScoreRequest fields (a header row with any of first_name, last_name, email, phone,
+# birthday, gender; an empty cell is a missing field) with the rules of get_score, a chunk of rows at a time.
+# The output has a score per input row, empty for rows online_score would reject.
+
+import csv
+import datetime
+import itertools
+import logging
+from optparse import OptionParser
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import api
+from scoring import score_key
+from store import MemcacheClient, parse_servers
+
+FIELDS = ("first_name", "last_name", "email", "phone", "birthday", "gender")
+PAIRS = (("phone", "email"), ("first_name", "last_name"), ("gender", "birthday"))
+# date(1970, 1, 1).toordinal(), datetime64[D] counts days from the epoch
+EPOCH_ORDINAL = 719163
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def parse_birthdays(values):
+    # -> (parsed mask, datetime64[D] days) with the semantics of api.parse_date: the canonical
+    # DD.MM.YYYY is parsed on arrays, the few other spellings strptime accepts one by one
+    n = len(values)
+    canonical = np.char.str_len(values) == 10
+    codes = values.astype("U10").view(np.uint32).reshape(n, 10)
+    digits = codes[:, [0, 1, 3, 4, 6, 7, 8, 9]] - ord("0")
+    canonical &= (codes[:, 2] == ord(".")) & (codes[:, 5] == ord(".")) & (digits <= 9).all(axis=1)
+    digits = np.where(canonical[:, None], digits, 0).astype(np.int64)
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    valid_month = (month >= 1) & (month <= 12)
+    month_days = np.asarray(DAYS_IN_MONTH)[np.where(valid_month, month - 1, 0)] + (leap & (month == 2))
+    parsed = canonical & valid_month & (year >= 1) & (day >= 1) & (day <= month_days)
+    year, month, day = np.where(parsed, year, 1970), np.where(parsed, month, 1), np.where(parsed, day, 1)
+    days = ((year - 1970) * 12 + month - 1).astype("datetime64[M]").astype("datetime64[D]") + (day - 1)
+
+    for i in np.flatnonzero(~canonical & (values != "")):
+        try:
+            days[i] = np.datetime64(api.parse_date(str(values[i])).date(), "D")
+            parsed[i] = True
+        except (ValueError, TypeError):
+            pass
+    return parsed, days
+
+
+def score_columns(columns):
+    # columns: field name -> sequence of strings, "" for a missing value. Returns (valid mask,
+    # scores, birthdays as day ordinals); scores of invalid rows are undefined
+    n = len(next(iter(columns.values())))
+    values = {field: np.asarray(columns.get(field, [""] * n), dtype=str) for field in FIELDS}
+    present = {field: values[field] != "" for field in FIELDS}
+
+    valid = np.zeros(n, dtype=bool)
+    for first, second in PAIRS:
+        valid |= present[first] & present[second]
+    phone = values["phone"]
+    valid &= ~present["phone"] | ((np.char.str_len(phone) == 11) & np.char.startswith(phone, "7"))
+    valid &= ~present["email"] | (np.char.find(values["email"], "@") >= 0)
+    gender = values["gender"]
+    valid &= ~present["gender"] | (gender == "0") | (gender == "1") | (gender == "2")
+    parsed, days = parse_birthdays(values["birthday"])
+    cutoff = np.datetime64(api.OnlineScoreRequest.fields["birthday"].cutoff().date(), "D")
+    valid &= ~present["birthday"] | (parsed & (days > cutoff))
+
+    # compute_score, term by term in the same order
+    scores = np.zeros(n)
+    scores += np.where(present["phone"], 1.5, 0.)
+    scores += np.where(present["email"], 1.5, 0.)
+    scores += np.where(present["birthday"] & ((gender == "1") | (gender == "2")), 1.5, 0.)
+    scores += np.where(present["first_name"] & present["last_name"], .5, 0.)
+    return valid, scores, days.astype(np.int64) + EPOCH_ORDINAL
+
+
+def read_chunks(source, chunk_size: int):
+    # CSV rows -> {field: column of strings} per chunk; blank lines are skipped like csv.DictReader does
+    reader = csv.reader(source)
+    header = next(reader, None)
+    if header is None:
+        return
+    width = len(header)
+    indices = {field: header.index(field) for field in FIELDS if field in header}
+    while True:
+        rows = list(itertools.islice(reader, chunk_size))
+        if not rows:
+            return
+        rows = [row if len(row) == width else (row + [""] * width)[:width] for row in rows if row]
+        if not rows:
+            continue
+        columns = list(zip(*rows))
+        yield {field: columns[i] for field, i in indices.items()} or {"phone": ("",) * len(rows)}
+
+
+def cache_values(columns, valid, scores, ordinals):
+    # score_key of every valid row, computed by the same function as get_score
+    values = {}
+    for i in np.flatnonzero(valid):
+        item = {field: columns[field][i] or None for field in columns}
+        if item.get("gender") is not None:
+            item["gender"] = int(item["gender"])
+        if item.get("birthday") is not None:
+            item["birthday"] = datetime.date.fromordinal(int(ordinals[i]))
+        values[score_key(**item)] = float(scores[i])
+    return values
+
+
+def run(source, destination, chunk_size: int = 100000, store=None):
+    if np is None:
+        raise RuntimeError("bulk scoring needs numpy: pip install numpy")
+    rows = invalid = 0
+    destination.write("score\n")
+    for columns in read_chunks(source, chunk_size):
+        valid, scores, ordinals = score_columns(columns)
+        destination.write("".join("%r\n" % score if ok else "\n" for ok, score in zip(valid.tolist(),
+                                                                                      scores.tolist())))
+        if store is not None:
+            store.cache_set_many(cache_values(columns, valid, scores, ordinals), 60 * 60)
+        rows += len(valid)
+        invalid += len(valid) - int(valid.sum())
+    return rows, invalid
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-i", "--input", action="store", default=None, help="CSV file, stdin by default")
+    op.add_option("-o", "--output", action="store", default=None, help="scores CSV, stdout by default")
+    op.add_option("--chunk-size", action="store", type=int, default=100000, help="rows scored at once")
+    op.add_option("--memcache", action="store", default="localhost:11211")
+    op.add_option("--push", action="store_true", default=False,
+                  help="store the scores in memcache under the keys get_score looks up")
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    if np is None:
+        op.error("numpy is not installed")
+    store = MemcacheClient(servers=parse_servers(opts.memcache)) if opts.push else None
+    source = open(opts.input, newline="", encoding="utf-8") if opts.input else sys.stdin
+    destination = open(opts.output, "w") if opts.output else sys.stdout
+    try:
+        rows, invalid = run(source, destination, opts.chunk_size, store)
+    finally:
+        if store is not None:
+            store.close()
+        destination.flush()
+    logging.info("Scored %s rows, %s invalid", rows, invalid)
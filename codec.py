@@ -0,0 +1,49 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _json_dumps(obj):
+    return json.dumps(obj).encode('utf-8')
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def _orjson_dumps(obj):
+    # clients_interests answers are keyed by integer client ids
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+BACKENDS = {"json": (json.loads, _json_dumps)}
+if ujson is not None:
+    BACKENDS["ujson"] = (ujson.loads, _ujson_dumps)
+if orjson is not None:
+    BACKENDS["orjson"] = (orjson.loads, _orjson_dumps)
+
+BACKEND = None
+loads = None
+dumps = None
+
+
+def use(name: str = None):
+    # picks the fastest installed backend by default; dumps always returns bytes
+    global BACKEND, loads, dumps
+    if name is None:
+        name = next(backend for backend in ("orjson", "ujson", "json") if backend in BACKENDS)
+    if name not in BACKENDS:
+        raise ValueError(f"JSON backend '{name}' is not installed")
+    BACKEND = name
+    loads, dumps = BACKENDS[name]
+
+
+use()
@@ -0,0 +1,63 @@
+import asyncio
+import contextlib
+import contextvars
+import time
+
+# the time.monotonic() by which the current request must be answered, None when it has no budget.
+# A context variable reaches the store calls of a handler without threading it through every
+# function: each thread and asyncio task sees the value of its own request.
+DEADLINE = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+def after(seconds):
+    return None if seconds is None else time.monotonic() + seconds
+
+
+def remaining():
+    deadline = DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check():
+    if expired():
+        raise DeadlineExceeded("request deadline exceeded")
+
+
+def timeout(default):
+    # the smaller of `default` and the time left
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded("request deadline exceeded")
+    return min(default, left)
+
+
+async def wait_for(awaitable, default):
+    # asyncio.wait_for with timeout(default): running out of the request's time rather than
+    # `default` raises DeadlineExceeded, so callers do not take it for a slow server
+    limit = timeout(default)
+    try:
+        return await asyncio.wait_for(awaitable, limit)
+    except asyncio.TimeoutError:
+        if limit < default:
+            raise DeadlineExceeded("request deadline exceeded") from None
+        raise
+
+
+@contextlib.contextmanager
+def scope(deadline):
+    token = DEADLINE.set(deadline)
+    try:
+        yield
+    finally:
+        DEADLINE.reset(token)
@@ -0,0 +1,93 @@
+import logging
+import os
+import queue
+import sys
+import threading
+
+import metrics
+
+DROPPED = metrics.Counter("scoring_log_records_dropped_total", "Log records dropped because the queue was full.")
+
+
+class QueueHandler(logging.Handler):
+    # request threads only put records on a bounded queue, a background thread formats them
+    # and writes whole batches with one write and one flush. When the queue is full the record
+    # is dropped and counted instead of blocking the request.
+    def __init__(self, stream=None, max_size: int = 10000, batch_size: int = 512):
+        super().__init__()
+        self.stream = stream or sys.stderr
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.start()
+        # threads do not survive fork, every worker starts its own writer
+        os.register_at_fork(after_in_child=self.start)
+
+    def start(self):
+        self.queue = queue.Queue(self.max_size)
+        self.writer = threading.Thread(target=self.write_batches, name="log-writer", daemon=True)
+        self.writer.start()
+
+    def emit(self, record):
+        if record.exc_info:
+            # tracebacks are rendered by the caller, the frames must not outlive it
+            record.formatted = self.format(record)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            DROPPED.inc()
+
+    def write_batches(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self.write([record for record in batch if record is not None])
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    def write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(getattr(record, "formatted", None) or self.format(record))
+            except Exception:
+                self.handleError(record)
+        if lines:
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+
+    def flush(self):
+        # waits until everything queued so far is written
+        if self.writer.is_alive():
+            self.queue.join()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        if self.stream not in (sys.stdout, sys.stderr):
+            self.stream.close()
+        super().close()
+
+
+def setup(filename=None, level=logging.INFO, format=None, datefmt=None, max_size: int = 10000):
+    # logging.basicConfig(filename=...) with the queued handler
+    stream = open(filename, "a", encoding="utf-8") if filename else None
+    handler = QueueHandler(stream, max_size)
+    handler.setFormatter(logging.Formatter(format, datefmt))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
@@ -0,0 +1,133 @@
+import bisect
+import threading
+
+# metrics in the Prometheus text exposition format. Every thread updates its own shard
+# without locking, a scrape sums the shards. A forked worker reports its own process only.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5)
+
+REGISTRY = []
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    pairs = ['%s="%s"' % (name, escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.__local = threading.local()
+        self.__shards = []
+        self.__lock = threading.Lock()
+        if registry is not None:
+            registry.append(self)
+
+    def shard(self):
+        try:
+            return self.__local.shard
+        except AttributeError:
+            shard = self.__local.shard = {}
+            # the only lock, taken once per thread
+            with self.__lock:
+                self.__shards.append(shard)
+            return shard
+
+    def shards(self):
+        with self.__lock:
+            shards = list(self.__shards)
+        # copying a dict is atomic under the GIL, owners may keep writing meanwhile
+        return [shard.copy() for shard in shards]
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.type)]
+        lines.extend("%s%s %s" % (name, labels, value) for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, value=1):
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+    def collect(self):
+        totals = {}
+        for shard in self.shards():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # per shard and labels: a count per bucket, one for +Inf, then the sum
+        shard = self.shard()
+        data = shard.get(labels)
+        if data is None:
+            data = shard[labels] = [0] * (len(self.buckets) + 1) + [0.]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def collect(self):
+        totals = {}
+        for shard in self.shards():
+            for labels, data in shard.items():
+                data = list(data)
+                total = totals.setdefault(labels, [0] * len(data))
+                for i, value in enumerate(data):
+                    total[i] += value
+        return totals
+
+    def samples(self):
+        for labels, data in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), data):
+                cumulative += count
+                yield self.name + "_bucket", format_labels(self.labelnames, labels, 'le="%s"' % bound), cumulative
+            yield self.name + "_sum", format_labels(self.labelnames, labels), data[-1]
+            yield self.name + "_count", format_labels(self.labelnames, labels), cumulative
+
+
+class CallbackMetric(Metric):
+    # values owned by some other object, read at scrape time: callback() -> {labels tuple: value}
+    def __init__(self, name: str, documentation: str, callback, labelnames=(), type="gauge", registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.callback = callback
+        self.type = type
+
+    def collect(self):
+        return self.callback()
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+def render(registry=REGISTRY):
+    return "\n".join(metric.render() for metric in registry) + "\n"
@@ -0,0 +1,143 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+LIMITED = metrics.Counter("scoring_rate_limited_total", "Requests rejected by the rate limiter, by bucket scope.",
+                          ("scope",))
+SYNC_ERRORS = metrics.Counter("scoring_rate_limit_sync_errors_total", "Failed rate limit synchronizations.")
+
+# a bucket: [tokens, last refill, admitted since the last sync, rate, burst, blocked until]
+TOKENS, UPDATED, ADMITTED, RATE, BURST, BLOCKED = range(6)
+
+
+def parse_limit(value):
+    # {"rate": requests per second, "burst": bucket size, the rate by default}
+    if value is None:
+        return None
+    rate = float(value["rate"])
+    return rate, float(value.get("burst", rate))
+
+
+class RateLimiter:
+    # token buckets per login or account. The limits file looks like
+    #   {"default": {"rate": 100, "burst": 200},
+    #    "accounts": {"horns&hoofs": {"rate": 50}},
+    #    "logins": {"h&f": {"rate": 10, "burst": 20}},
+    #    "unverified": {"rate": 20}}
+    # A login limit wins over the limit of its account, which all logins of the account share;
+    # other logins get a bucket each with the default limit, no default means no limit.
+    # Requests whose credentials are not verified yet go to a separate bucket of their login with the
+    # "unverified" limit, the default one if it is not given, so a bad token cannot use up a partner's
+    # bucket and a flood of bad tokens for one login does not hold back the others.
+    #
+    # With a store, a background thread adds what each process admitted to memcache counters of
+    # fixed `window`-second windows; once the total of a window is over rate * window + burst the
+    # bucket rejects everything until the window ends. The request path never waits for memcache.
+    def __init__(self, limits: dict, store=None, sync_interval: float = 1., window: float = 10.,
+                 max_keys: int = 100000):
+        self.default = parse_limit(limits.get("default"))
+        self.accounts = {name: parse_limit(value) for name, value in limits.get("accounts", {}).items()}
+        self.logins = {name: parse_limit(value) for name, value in limits.get("logins", {}).items()}
+        self.unverified = parse_limit(limits.get("unverified", limits.get("default")))
+        self.store = store
+        self.sync_interval = sync_interval
+        self.window = window
+        self.max_keys = max_keys
+        self.__buckets = {}
+        self.__lock = threading.Lock()
+        self.__stop = None
+        if store is not None:
+            self.start()
+            # threads do not survive fork, every worker synchronizes on its own
+            os.register_at_fork(after_in_child=self.start)
+
+    @classmethod
+    def from_file(cls, filename, **kwargs):
+        with open(filename) as f:
+            return cls(json.load(f), **kwargs)
+
+    def bucket_key(self, account, login, verified=True):
+        # -> ((scope, name), (rate, burst)), or (None, None) when the request is not limited
+        if not verified:
+            return (("unverified", login), self.unverified) if self.unverified is not None else (None, None)
+        if login in self.logins:
+            return ("login", login), self.logins[login]
+        if account in self.accounts:
+            return ("account", account), self.accounts[account]
+        if self.default is not None:
+            return ("login", login), self.default
+        return None, None
+
+    def allow(self, account, login, verified=True):
+        key, limit = self.bucket_key(account, login, verified)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self.__lock:
+            bucket = self.__buckets.get(key)
+            if bucket is None:
+                if len(self.__buckets) >= self.max_keys:
+                    self.__evict(now)
+                bucket = self.__buckets[key] = [limit[1], now, 0, limit[0], limit[1], 0.]
+            bucket[TOKENS] = min(bucket[BURST], bucket[TOKENS] + (now - bucket[UPDATED]) * bucket[RATE])
+            bucket[UPDATED] = now
+            if bucket[TOKENS] >= 1 and bucket[BLOCKED] <= now:
+                bucket[TOKENS] -= 1
+                bucket[ADMITTED] += 1
+                return True
+        LIMITED.inc(key[0])
+        return False
+
+    def __evict(self, now):
+        # full buckets are the same as no bucket; if every one is in use the oldest go
+        for key, bucket in list(self.__buckets.items()):
+            if bucket[TOKENS] + (now - bucket[UPDATED]) * bucket[RATE] >= bucket[BURST] and bucket[BLOCKED] <= now:
+                del self.__buckets[key]
+        excess = len(self.__buckets) - self.max_keys + 1
+        for key in list(itertools.islice(self.__buckets, max(excess, 0))):
+            del self.__buckets[key]
+
+    def start(self):
+        self.__stop = threading.Event()
+        threading.Thread(target=self.run_sync, args=(self.__stop,), name="rate-limit-sync", daemon=True).start()
+
+    def run_sync(self, stop):
+        while not stop.wait(self.sync_interval):
+            self.sync()
+
+    def counter_key(self, key, window):
+        name = hashlib.blake2b(("%s\0%s" % key).encode('utf-8'), digest_size=12).hexdigest()
+        return "rl:%s:%d" % (name, window)
+
+    def sync(self):
+        now, wall = time.monotonic(), time.time()
+        window = int(wall // self.window)
+        window_end = now + (window + 1) * self.window - wall
+        with self.__lock:
+            admitted = [(key, bucket[ADMITTED], bucket[RATE] * self.window + bucket[BURST])
+                        for key, bucket in self.__buckets.items() if bucket[ADMITTED]]
+            for key, _, _ in admitted:
+                self.__buckets[key][ADMITTED] = 0
+        for key, count, allowance in admitted:
+            try:
+                total = self.store.incr(self.counter_key(key, window), count, int(self.window * 2))
+            except Exception as e:
+                # the local buckets keep limiting every process on its own
+                SYNC_ERRORS.inc()
+                logging.warning("Rate limit sync failed: %r", e)
+                return
+            if total is not None and total > allowance:
+                with self.__lock:
+                    bucket = self.__buckets.get(key)
+                    if bucket is not None:
+                        bucket[BLOCKED] = window_end
+
+    def close(self):
+        if self.__stop is not None:
+            self.__stop.set()
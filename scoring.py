@@ -1,24 +1,34 @@
+import binascii
 import hashlib
 import json
 
+from store import AsyncSingleFlight, SingleFlight
 
-def get_score(store, phone=None, email=None, birthday=None, gender=None, first_name=None, last_name=None):
+# read-through to the md5 "uid:" keys of earlier releases; a hit is copied to the current key
+LEGACY_KEYS = True
+
+
+def score_key(phone=None, email=None, birthday=None, gender=None, first_name=None, last_name=None):
+    # every field of the request, birthday as a day number instead of strftime; blake2b is faster
+    # than md5 and its 16 bytes take 22 base64 characters
+    fields = "%s\0%s\0%s\0%s\0%s\0%s" % (phone or "", email or "", birthday.toordinal() if birthday else "",
+                                         gender or "", first_name or "", last_name or "")
+    digest = hashlib.blake2b(fields.encode('utf-8'), digest_size=16).digest()
+    return "s2:" + binascii.b2a_base64(digest, newline=False)[:22].decode('ascii')
+
+
+def legacy_score_key(phone=None, birthday=None, first_name=None, last_name=None):
     key_parts = [
         first_name or "",
         last_name or "",
         phone or "",
         birthday.strftime("%Y%m%d") if birthday is not None else "",
         ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode('utf-8')).hexdigest()
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
-    try:
-        score = store.cache_get(key) or 0
-    except (ConnectionRefusedError, TimeoutError):
-        score = 0
+    return "uid:" + hashlib.md5("".join(key_parts).encode('utf-8')).hexdigest()
 
-    if score:
-        return score
+
+def compute_score(phone=None, email=None, birthday=None, gender=None, first_name=None, last_name=None):
+    score = 0
     if phone:
         score += 1.5
     if email:
@@ -27,6 +37,35 @@ def get_score(store, phone=None, email=None, birthday=None, gender=None, first_n
         score += 1.5
     if first_name and last_name:
         score += 0.5
+    return score
+
+
+SCORE_FLIGHTS = SingleFlight("score")
+ASYNC_SCORE_FLIGHTS = AsyncSingleFlight("score")
+
+
+def get_score(store, phone=None, email=None, birthday=None, gender=None, first_name=None, last_name=None):
+    key = score_key(phone, email, birthday, gender, first_name, last_name)
+    # concurrent lookups of one key share a single memcache fetch and write
+    return SCORE_FLIGHTS.do((id(store), key), fetch_score, store, key, phone, email, birthday, gender, first_name,
+                            last_name)
+
+
+def fetch_score(store, key, phone, email, birthday, gender, first_name, last_name):
+    # try get from cache,
+    # fallback to heavy calculation in case of cache miss
+    try:
+        score = float(store.cache_get(key) or 0)
+        if not score and LEGACY_KEYS:
+            score = float(store.cache_get(legacy_score_key(phone, birthday, first_name, last_name)) or 0)
+            if score:
+                store.cache_set(key, score, 60 * 60)
+    except (ConnectionRefusedError, TimeoutError):
+        score = 0
+
+    if score:
+        return score
+    score = compute_score(phone, email, birthday, gender, first_name, last_name)
     # cache for 60 minutes
     try:
         store.cache_set(key, score, 60 * 60)
@@ -35,6 +74,138 @@ def get_score(store, phone=None, email=None, birthday=None, gender=None, first_n
     return score
 
 
+async def get_score_async(store, phone=None, email=None, birthday=None, gender=None, first_name=None,
+                          last_name=None):
+    key = score_key(phone, email, birthday, gender, first_name, last_name)
+    return await ASYNC_SCORE_FLIGHTS.do((id(store), key), fetch_score_async, store, key, phone, email, birthday,
+                                        gender, first_name, last_name)
+
+
+async def fetch_score_async(store, key, phone, email, birthday, gender, first_name, last_name):
+    try:
+        score = float(await store.cache_get(key) or 0)
+        if not score and LEGACY_KEYS:
+            score = float(await store.cache_get(legacy_score_key(phone, birthday, first_name, last_name)) or 0)
+            if score:
+                await store.cache_set(key, score, 60 * 60)
+    except (ConnectionRefusedError, TimeoutError):
+        score = 0
+
+    if score:
+        return score
+    score = compute_score(phone, email, birthday, gender, first_name, last_name)
+    try:
+        await store.cache_set(key, score, 60 * 60)
+    except (ConnectionRefusedError, TimeoutError):
+        pass
+    return score
+
+
+def cached_scores(cached, keys=None):
+    # non-zero scores of a multi-get result, re-keyed through `keys` (found key -> list of keys) if given
+    scores = {}
+    for found_key, value in cached.items():
+        if value and float(value):
+            for key in keys.get(found_key, ()) if keys is not None else (found_key,):
+                scores[key] = float(value)
+    return scores
+
+
+def legacy_keys(items):
+    # legacy key -> current keys: the legacy key ignores email and gender, so several may share one
+    keys = {}
+    for key, item in items.items():
+        legacy_key = legacy_score_key(item.get("phone"), item.get("birthday"), item.get("first_name"),
+                                      item.get("last_name"))
+        keys.setdefault(legacy_key, []).append(key)
+    return keys
+
+
+def get_scores(store, items):
+    # batch version of get_score for a list of get_score keyword dicts: identical keys are looked up once,
+    # cached scores come from one multi-get (one more for legacy keys of the misses) and the computed
+    # or copied ones are written back with one multi-set
+    keys = [score_key(**item) for item in items]
+    missed = {}
+    try:
+        scores = cached_scores(store.cache_get_many(set(keys)))
+        missed = {key: item for key, item in zip(keys, items) if key not in scores}
+    except (ConnectionRefusedError, TimeoutError):
+        scores = {}
+    if missed and LEGACY_KEYS:
+        legacy = legacy_keys(missed)
+        try:
+            scores.update(cached_scores(store.cache_get_many(legacy), legacy))
+        except (ConnectionRefusedError, TimeoutError):
+            pass
+
+    writes = {key: scores[key] for key in missed if key in scores}
+    for key, item in zip(keys, items):
+        if key not in scores:
+            scores[key] = writes[key] = compute_score(**item)
+    if writes:
+        try:
+            store.cache_set_many(writes, 60 * 60)
+        except (ConnectionRefusedError, TimeoutError):
+            pass
+    return [scores[key] for key in keys]
+
+
+async def get_scores_async(store, items):
+    keys = [score_key(**item) for item in items]
+    missed = {}
+    try:
+        scores = cached_scores(await store.cache_get_many(set(keys)))
+        missed = {key: item for key, item in zip(keys, items) if key not in scores}
+    except (ConnectionRefusedError, TimeoutError):
+        scores = {}
+    if missed and LEGACY_KEYS:
+        legacy = legacy_keys(missed)
+        try:
+            scores.update(cached_scores(await store.cache_get_many(legacy), legacy))
+        except (ConnectionRefusedError, TimeoutError):
+            pass
+
+    writes = {key: scores[key] for key in missed if key in scores}
+    for key, item in zip(keys, items):
+        if key not in scores:
+            scores[key] = writes[key] = compute_score(**item)
+    if writes:
+        try:
+            await store.cache_set_many(writes, 60 * 60)
+        except (ConnectionRefusedError, TimeoutError):
+            pass
+    return [scores[key] for key in keys]
+
+
+def interests_key(cid):
+    return "i:%s" % cid
+
+
+def decode_interests(value):
+    # compact values arrive decoded by the serde, legacy ones as JSON strings
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    return json.loads(value)
+
+
 def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+    return decode_interests(store.get(interests_key(cid)))
+
+
+async def get_interests_async(store, cid):
+    return decode_interests(await store.get(interests_key(cid)))
+
+
+def get_interests_many(store, cids):
+    keys = {cid: interests_key(cid) for cid in cids}
+    found = store.get_many(keys.values())
+    return {cid: decode_interests(found.get(key)) for cid, key in keys.items()}
+
+
+async def get_interests_many_async(store, cids):
+    keys = {cid: interests_key(cid) for cid in cids}
+    found = await store.get_many(keys.values())
+    return {cid: decode_interests(found.get(key)) for cid, key in keys.items()}
@@ -0,0 +1,116 @@
+import json
+import logging
+import struct
+
+# pymemcache serde objects for the values this service keeps in memcache.
+#
+# legacy: values are stored as str(value) with flags 0, which is what the clients have always done.
+# compact: scores are packed floats and interests are arrays of ids into a versioned vocabulary.
+# The formats differ only in writing: both read flags 0 values as raw bytes and decode the compact
+# flags, so readers can be upgraded before writers switch and a legacy writer reads the compact values.
+
+FLAG_SCORE = 0x100
+FLAG_INTERESTS = 0x200
+
+# a released vocabulary never changes: new words go into a new version, which older readers
+# treat as a miss instead of failing on an id they do not know
+VOCABULARIES = {
+    1: ("cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"),
+    }
+VERSION = max(VOCABULARIES)
+ESCAPE = 0xFF
+
+HALF = struct.Struct("<e")
+DOUBLE = struct.Struct("<d")
+
+
+def pack_score(value):
+    # scores are sums of halves: two bytes hold them exactly, anything else takes eight
+    packed = HALF.pack(value) if abs(value) < 65504 else None
+    if packed is None or HALF.unpack(packed)[0] != value:
+        packed = DOUBLE.pack(value)
+    return packed
+
+
+def unpack_score(data):
+    return (HALF if len(data) == HALF.size else DOUBLE).unpack(data)[0]
+
+
+def pack_interests(interests, version=VERSION):
+    # [version][item]...: an item is an id into the vocabulary or ESCAPE, length and utf-8 bytes;
+    # returns None when an item does not fit the format
+    ids = {word: i for i, word in enumerate(VOCABULARIES[version])}
+    data = bytearray((version,))
+    for interest in interests:
+        if not isinstance(interest, str):
+            return None
+        i = ids.get(interest)
+        if i is not None:
+            data.append(i)
+            continue
+        encoded = interest.encode('utf-8')
+        if len(encoded) > 255:
+            return None
+        data.append(ESCAPE)
+        data.append(len(encoded))
+        data.extend(encoded)
+    return bytes(data)
+
+
+def unpack_interests(data):
+    vocabulary = VOCABULARIES.get(data[0])
+    if vocabulary is None:
+        # written by a newer release, treated as a miss
+        logging.warning("Unknown interests format version %s", data[0])
+        return None
+    try:
+        if ESCAPE not in data:
+            return [vocabulary[i] for i in data[1:]]
+        interests = []
+        i = 1
+        while i < len(data):
+            if data[i] == ESCAPE:
+                size = data[i + 1]
+                interests.append(data[i + 2:i + 2 + size].decode('utf-8'))
+                i += 2 + size
+            else:
+                interests.append(vocabulary[data[i]])
+                i += 1
+        return interests
+    except IndexError:
+        # words added to a released version by a newer writer, treated as a miss as well
+        logging.warning("Unknown interest id in format version %s", data[0])
+        return None
+
+
+class Serde:
+    def deserialize(self, key, value, flags):
+        if flags == FLAG_SCORE:
+            return unpack_score(value)
+        if flags == FLAG_INTERESTS:
+            return unpack_interests(value)
+        return value
+
+
+class LegacySerde(Serde):
+    def serialize(self, key, value):
+        return value, 0
+
+
+class CompactSerde(Serde):
+    def serialize(self, key, value):
+        if isinstance(value, (float, int)) and not isinstance(value, bool):
+            return pack_score(value), FLAG_SCORE
+        if isinstance(value, (list, tuple)):
+            packed = pack_interests(value)
+            if packed is not None:
+                return packed, FLAG_INTERESTS
+            # legacy JSON is still understood by every reader
+            return json.dumps(value).encode('utf-8'), 0
+        return value, 0
+
+
+SERDES = {
+    "legacy": LegacySerde,
+    "compact": CompactSerde,
+    }
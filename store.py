@@ -1,40 +1,792 @@
+import asyncio
+import bisect
+from collections import OrderedDict
+import contextlib
 import functools
+import hashlib
+import logging
+import queue
+import random
+import sys
+import threading
 import time
+import weakref
 
 import pymemcache
+from pymemcache.exceptions import MemcacheServerError, MemcacheUnexpectedCloseError, MemcacheUnknownError
 
+import deadline
+import metrics
+from serde import LegacySerde
+
+RETRIES = metrics.Counter("scoring_retries_total", "Retried calls by function.", ("function",))
+MEMCACHE_LOOKUPS = metrics.Counter("scoring_memcache_lookups_total", "Keys looked up in memcache by result.",
+                                   ("result",))
+MEMCACHE_ERRORS = metrics.Counter("scoring_memcache_errors_total", "Failed memcache calls by operation.",
+                                  ("operation",))
+WRITES_DROPPED = metrics.Counter("scoring_write_behind_dropped_total",
+                                 "Cache writes dropped because the write-behind queue was full.")
+WRITES_FAILED = metrics.Counter("scoring_write_behind_failed_total", "Write-behind cache writes memcache rejected.")
+SHARED_CALLS = metrics.Counter("scoring_single_flight_shared_total",
+                               "Calls answered by another caller's in-flight call.", ("group",))
+
+
+def count_lookups(keys: int, found: int):
+    if found:
+        MEMCACHE_LOOKUPS.inc("hit", value=found)
+    if keys > found:
+        MEMCACHE_LOOKUPS.inc("miss", value=keys - found)
+
+
+def retry(exception=Exception, retries=3, backoff_in_seconds=.05, max_backoff_in_seconds=.5, deadline_in_seconds=1.):
+    # exponential backoff with full jitter, a call never sleeps past its deadline or the request's
+    def next_delay(attempt, started):
+        delay = random.uniform(0, min(max_backoff_in_seconds, backoff_in_seconds * 2 ** attempt))
+        if attempt == retries or time.monotonic() - started + delay > deadline_in_seconds:
+            return None
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            return None
+        return delay
 
-def retry(exception=Exception, retries=3, backoff_in_seconds=1):
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.monotonic()
+                for i in range(1, retries+1):
+                    try:
+                        return await func(*args, **kwargs)
+                    except exception:
+                        delay = next_delay(i, started)
+                        if delay is None:
+                            raise
+                        logging.warning(f'Retrying {func.__name__}: {i}/{retries}')
+                        RETRIES.inc(func.__name__.strip("_"))
+                        await asyncio.sleep(delay)
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            started = time.monotonic()
             for i in range(1, retries+1):
                 try:
                     return func(*args, **kwargs)
-                except exception as e:
-                    print(f'Retrying {func.__name__}: {i}/{retries}')
-                    time.sleep(backoff_in_seconds * 2 ** i)
-                    if i == retries:
-                        raise e
+                except exception:
+                    delay = next_delay(i, started)
+                    if delay is None:
+                        raise
+                    logging.warning(f'Retrying {func.__name__}: {i}/{retries}')
+                    RETRIES.inc(func.__name__.strip("_"))
+                    time.sleep(delay)
         return wrapper
     return decorator
 
 
+class CircuitOpenError(ConnectionRefusedError):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 10., half_open_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.__opened_at = 0.
+        self.__trials = 0
+        self.__lock = threading.Lock()
+
+    def before_call(self):
+        with self.__lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.__opened_at < self.recovery_timeout:
+                    raise CircuitOpenError("memcache circuit is open")
+                self.state = self.HALF_OPEN
+                self.__trials = 0
+            if self.state == self.HALF_OPEN:
+                if self.__trials >= self.half_open_calls:
+                    raise CircuitOpenError("memcache circuit is half-open")
+                self.__trials += 1
+
+    def on_success(self):
+        with self.__lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def on_abort(self):
+        # the call ended without showing whether memcache works: give back its half-open trial
+        with self.__lock:
+            if self.state == self.HALF_OPEN and self.__trials:
+                self.__trials -= 1
+
+    def on_failure(self):
+        with self.__lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning("memcache circuit opened after %s failures", self.failures)
+                self.state = self.OPEN
+                self.__opened_at = time.monotonic()
+
+
+BREAKER_FAILURES = (OSError, MemcacheServerError)
+
+
+def circuit(func):
+    # fails fast with CircuitOpenError while the client's breaker is open
+    # and with DeadlineExceeded once the request is out of time
+    operation = func.__name__.strip("_")
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self, *args, **kwargs):
+            deadline.check()
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                result = await func(self, *args, **kwargs)
+            except deadline.DeadlineExceeded:
+                # the request ran out of time, memcache did not fail
+                if self.breaker is not None:
+                    self.breaker.on_abort()
+                raise
+            except BREAKER_FAILURES:
+                MEMCACHE_ERRORS.inc(operation)
+                if self.breaker is not None:
+                    self.breaker.on_failure()
+                raise
+            except BaseException:
+                if self.breaker is not None:
+                    self.breaker.on_abort()
+                raise
+            if self.breaker is not None:
+                self.breaker.on_success()
+            return result
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        deadline.check()
+        if self.breaker is not None:
+            self.breaker.before_call()
+        try:
+            result = func(self, *args, **kwargs)
+        except deadline.DeadlineExceeded:
+            if self.breaker is not None:
+                self.breaker.on_abort()
+            raise
+        except BREAKER_FAILURES:
+            MEMCACHE_ERRORS.inc(operation)
+            if self.breaker is not None:
+                self.breaker.on_failure()
+            raise
+        except BaseException:
+            if self.breaker is not None:
+                self.breaker.on_abort()
+            raise
+        if self.breaker is not None:
+            self.breaker.on_success()
+        return result
+    return wrapper
+
+
+DEFAULT_SERVERS = (('localhost', 11211),)
+
+
+def parse_servers(value: str):
+    servers = []
+    for node in value.split(","):
+        host, _, port = node.strip().rpartition(":")
+        servers.append((host or 'localhost', int(port)))
+    return servers
+
+
+class HashRing:
+    # consistent hashing: every node owns `replicas` points on the ring, a key belongs
+    # to the first point clockwise from its hash, so adding a node moves ~1/N of the keys
+    def __init__(self, nodes, replicas: int = 160):
+        self.nodes = list(nodes)
+        points = sorted((self.hash(f"{node}-{i}"), node) for node in self.nodes for i in range(replicas))
+        self.__hashes = [point for point, _ in points]
+        self.__nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:4], 'little')
+
+    def get_node(self, key: str):
+        if len(self.nodes) == 1:
+            return self.nodes[0]
+        i = bisect.bisect(self.__hashes, self.hash(key))
+        return self.__nodes[i % len(self.__nodes)]
+
+    def group(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.get_node(key), []).append(key)
+        return groups
+
+
+class SingleFlight:
+    # concurrent calls with the same key share one execution: the first caller runs func,
+    # the others wait for its result or exception
+    def __init__(self, name: str):
+        self.name = name
+        self.__calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        # a call is [lock held by the leader until the outcome is set, result, exception];
+        # dict.setdefault is atomic, so whoever inserts first leads without a global lock
+        lock = threading.Lock()
+        lock.acquire()
+        call = [lock, None, None]
+        shared = self.__calls.setdefault(key, call)
+        if shared is not call:
+            SHARED_CALLS.inc(self.name)
+            with shared[0]:
+                pass
+            if shared[2] is not None:
+                raise shared[2]
+            return shared[1]
+        try:
+            call[1] = func(*args, **kwargs)
+            return call[1]
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            del self.__calls[key]
+            lock.release()
+
+
+class AsyncSingleFlight:
+    # SingleFlight for coroutines of one event loop
+    def __init__(self, name: str):
+        self.name = name
+        self.__calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self.__calls.get(key)
+        if task is None:
+            task = self.__calls[key] = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda _: self.__calls.pop(key, None))
+        else:
+            SHARED_CALLS.inc(self.name)
+        # a cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+
+class LocalCache:
+    # process-local LRU cache bounded by number of entries and approximate memory footprint;
+    # expired entries are kept `grace` more seconds for lookup(), get() never returns them
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 16 * 2 ** 20, ttl: int = 60 * 60,
+                 grace: int = 0, name: str = "local"):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.grace = grace
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+        LOCAL_CACHES.add(self)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def get(self, key):
+        found, value, fresh = self.lookup(key)
+        return value if fresh else None
+
+    def lookup(self, key):
+        # -> (found, value, fresh)
+        now = time.monotonic()
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is not None and item[1] + self.grace < now:
+                self.__remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return False, None, False
+            self.__data.move_to_end(key)
+            if item[1] < now:
+                self.stale_hits += 1
+                return True, item[0], False
+            self.hits += 1
+            return True, item[0], True
+
+    def set(self, key, value, expire_time: int = None):
+        ttl = min(expire_time or self.ttl, self.ttl)
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        with self.__lock:
+            if key in self.__data:
+                self.__remove(key)
+            self.__data[key] = (value, time.monotonic() + ttl, size)
+            self.bytes += size
+            while len(self.__data) > self.max_entries or self.bytes > self.max_bytes:
+                self.__remove(next(iter(self.__data)))
+                self.evictions += 1
+
+    def __remove(self, key):
+        self.bytes -= self.__data.pop(key)[2]
+
+
+LOCAL_CACHES = weakref.WeakSet()
+
+
+def local_cache_stat(get):
+    def collect():
+        totals = {}
+        for cache in list(LOCAL_CACHES):
+            totals[(cache.name,)] = totals.get((cache.name,), 0) + get(cache)
+        return totals
+    return collect
+
+
+metrics.CallbackMetric("scoring_local_cache_hits_total", "Local cache hits.",
+                       local_cache_stat(lambda cache: cache.hits), ("cache",), "counter")
+metrics.CallbackMetric("scoring_local_cache_misses_total", "Local cache misses.",
+                       local_cache_stat(lambda cache: cache.misses), ("cache",), "counter")
+metrics.CallbackMetric("scoring_local_cache_stale_hits_total", "Expired entries served within the grace period.",
+                       local_cache_stat(lambda cache: cache.stale_hits), ("cache",), "counter")
+metrics.CallbackMetric("scoring_local_cache_evictions_total", "Entries evicted from the local cache.",
+                       local_cache_stat(lambda cache: cache.evictions), ("cache",), "counter")
+metrics.CallbackMetric("scoring_local_cache_bytes", "Approximate local cache size in bytes.",
+                       local_cache_stat(lambda cache: cache.bytes), ("cache",))
+metrics.CallbackMetric("scoring_local_cache_entries", "Entries in the local cache.", local_cache_stat(len), ("cache",))
+
+
+class HotKeys:
+    # approximate lookup counts of the most requested keys, for warming up a restarted memcache.
+    # A `sample` share of lookups is counted; once `max_keys` keys are tracked all counts are halved
+    # and the keys left at zero are dropped, so old traffic fades out.
+    def __init__(self, max_keys: int = 100000, sample: float = .01):
+        self.max_keys = max_keys
+        self.sample = sample
+        self.__counts = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__counts)
+
+    def record(self, keys):
+        if self.sample < 1 and random.random() >= self.sample:
+            return
+        counts = self.__counts
+        for key in keys:
+            # racing increments may lose a count, which sampling does anyway
+            counts[key] = counts.get(key, 0) + 1
+        if len(counts) > self.max_keys:
+            with self.__lock:
+                if len(self.__counts) > self.max_keys:
+                    self.__counts = {key: count // 2 for key, count in self.__counts.items() if count > 1}
+
+    def top(self, limit: int = None):
+        counts = self.__counts.copy()
+        return sorted(counts, key=counts.get, reverse=True)[:limit]
+
+
+# negative entry of the read cache: the key was confirmed missing in memcache
+MISSING = object()
+
+
 class MemcacheClient:
-    def __init__(self, timeout: float = 5.):
-        self.__client = pymemcache.client.base.Client(('localhost', 11211), timeout=timeout)
+    def __init__(self, timeout: float = 5., chunk_size: int = 100, servers=DEFAULT_SERVERS, pool_size: int = 16,
+                 pool_idle_timeout: float = 60., local_cache: LocalCache = None, breaker: CircuitBreaker = None,
+                 write_behind: int = 0, serde=None, read_cache: LocalCache = None, negative_ttl: int = 30,
+                 hot_keys: HotKeys = None):
+        # a bounded pool of connections per node makes the client safe to share between threads
+        self.__clients = {
+            node: pymemcache.client.base.PooledClient(node, timeout=timeout, max_pool_size=pool_size,
+                                                      pool_idle_timeout=pool_idle_timeout, no_delay=True,
+                                                      serde=serde or LegacySerde())
+            for node in map(tuple, servers)
+            }
+        self.__ring = HashRing(self.__clients)
+        self.chunk_size = chunk_size
+        self.local_cache = local_cache
+        self.breaker = breaker or CircuitBreaker()
+        # write-behind: cache_set and cache_set_many only queue up to `write_behind` items,
+        # a background thread stores them with multi-sets
+        self.__writes = None
+        if write_behind:
+            self.__writes = queue.Queue(write_behind)
+            self.__writer = threading.Thread(target=self.__write_batches, name="memcache-writer", daemon=True)
+            self.__writer.start()
+        # read cache for get and get_many: misses are remembered for `negative_ttl` seconds, entries
+        # within the cache's grace period are returned at once and refreshed by a background thread
+        self.read_cache = read_cache
+        self.negative_ttl = negative_ttl
+        self.hot_keys = hot_keys
+        if read_cache is not None:
+            self.__refreshing = set()
+            self.__refreshes = queue.Queue(read_cache.max_entries)
+            self.__refresher = threading.Thread(target=self.__refresh_batches, name="memcache-refresher",
+                                                daemon=True)
+            self.__refresher.start()
+
+    def __client(self, key):
+        return self.__clients[self.__ring.get_node(key)]
 
-    @retry(ConnectionRefusedError)
     def cache_get(self, key):
-        return self.__client.get(key, None)
+        if self.hot_keys is not None:
+            self.hot_keys.record((key,))
+        if self.local_cache is None:
+            return self.__cache_get(key)
+        value = self.local_cache.get(key)
+        if value is None:
+            value = self.__cache_get(key)
+            if value is not None:
+                self.local_cache.set(key, value)
+        return value
 
+    @circuit
     @retry(ConnectionRefusedError)
+    def __cache_get(self, key):
+        value = self.__client(key).get(key, None)
+        count_lookups(1, value is not None)
+        return value
+
     def get(self, key):
-        return self.__client.get(key, None)
+        if self.read_cache is not None:
+            return self.get_many([key]).get(key)
+        if self.hot_keys is not None:
+            self.hot_keys.record((key,))
+        return self.__get(key)
 
+    @circuit
     @retry(ConnectionRefusedError)
+    def __get(self, key):
+        value = self.__client(key).get(key, None)
+        count_lookups(1, value is not None)
+        return value
+
+    def get_many(self, keys):
+        if self.hot_keys is not None:
+            keys = list(keys)
+            self.hot_keys.record(keys)
+        if self.read_cache is None:
+            return self.__get_many(keys)
+        result, missed, stale = {}, [], []
+        for key in keys:
+            found, value, fresh = self.read_cache.lookup(key)
+            if not found:
+                missed.append(key)
+                continue
+            if value is not MISSING:
+                result[key] = value
+            if not fresh:
+                stale.append(key)
+        if stale:
+            self.__refresh(stale)
+        if missed:
+            found = self.__get_many(missed)
+            self.__remember(missed, found)
+            result.update(found)
+        return result
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    def __get_many(self, keys):
+        # one multi-get round-trip per node and chunk, missing keys are absent from the result
+        result = {}
+        groups = self.__ring.group(keys)
+        for node, node_keys in groups.items():
+            for i in range(0, len(node_keys), self.chunk_size):
+                result.update(self.__clients[node].get_many(node_keys[i:i + self.chunk_size]))
+        count_lookups(sum(map(len, groups.values())), len(result))
+        return result
+
+    def __remember(self, keys, found):
+        for key in keys:
+            if key in found:
+                self.read_cache.set(key, found[key])
+            else:
+                self.read_cache.set(key, MISSING, self.negative_ttl)
+
+    def __refresh(self, keys):
+        # a key is queued once however many requests see it stale; when the queue is full the stale
+        # value is served until a later lookup gets the key queued
+        for key in keys:
+            if key in self.__refreshing:
+                continue
+            self.__refreshing.add(key)
+            try:
+                self.__refreshes.put_nowait(key)
+            except queue.Full:
+                self.__refreshing.discard(key)
+
+    def __refresh_batches(self):
+        while True:
+            batch = [self.__refreshes.get()]
+            while len(batch) < self.chunk_size:
+                try:
+                    batch.append(self.__refreshes.get_nowait())
+                except queue.Empty:
+                    break
+            keys = [key for key in batch if key is not None]
+            if keys:
+                try:
+                    self.__remember(keys, self.__get_many(keys))
+                except Exception as e:
+                    # the stale entries stay until their grace period ends, later lookups retry
+                    logging.warning("Refresh of %s keys failed: %r", len(keys), e)
+                finally:
+                    self.__refreshing.difference_update(keys)
+            for _ in batch:
+                self.__refreshes.task_done()
+            if None in batch:
+                return
+
+    def cache_get_many(self, keys):
+        # scores go through the local cache only, the read cache is for client interests
+        if self.hot_keys is not None:
+            keys = list(keys)
+            self.hot_keys.record(keys)
+        if self.local_cache is None:
+            return self.__get_many(keys)
+        result, missed = {}, []
+        for key in keys:
+            value = self.local_cache.get(key)
+            if value is None:
+                missed.append(key)
+            else:
+                result[key] = value
+        if missed:
+            found = self.__get_many(missed)
+            for key, value in found.items():
+                self.local_cache.set(key, value)
+            result.update(found)
+        return result
+
     def cache_set(self, key, value, expire_time: int = 60):
-        return self.__client.set(key, value, expire_time)
+        if self.local_cache is not None:
+            self.local_cache.set(key, value, expire_time)
+        if self.__writes is not None:
+            return self.__enqueue(key, value, expire_time)
+        return self.__cache_set(key, value, expire_time)
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    def __cache_set(self, key, value, expire_time):
+        return self.__client(key).set(key, value, expire_time)
+
+    def cache_set_many(self, values, expire_time: int = 60, noreply: bool = True):
+        # returns the keys which could not be queued for write-behind or, with noreply=False, the keys
+        # memcache did not store; with noreply direct writes do not wait for memcache's replies
+        if self.local_cache is not None:
+            for key, value in values.items():
+                self.local_cache.set(key, value, expire_time)
+        if self.__writes is not None:
+            return [key for key, value in values.items() if not self.__enqueue(key, value, expire_time)]
+        return self.__cache_set_many(values, expire_time, noreply)
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    def __cache_set_many(self, values, expire_time, noreply=True):
+        # returns the keys memcache did not store, always empty with noreply
+        failed = []
+        for node, node_keys in self.__ring.group(values).items():
+            for i in range(0, len(node_keys), self.chunk_size):
+                chunk = {key: values[key] for key in node_keys[i:i + self.chunk_size]}
+                failed.extend(self.__clients[node].set_many(chunk, expire_time, noreply=noreply))
+        return failed
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    def incr(self, key, delta: int = 1, expire_time: int = 60):
+        # the counter is created by the first increment; returns the new value
+        client = self.__client(key)
+        value = client.incr(key, delta, noreply=False)
+        if value is None and client.add(key, str(delta), expire_time, noreply=False):
+            return delta
+        if value is None:
+            # another client created it meanwhile
+            value = client.incr(key, delta, noreply=False)
+        return value
+
+    def __enqueue(self, key, value, expire_time):
+        try:
+            self.__writes.put_nowait((key, value, expire_time))
+            return True
+        except queue.Full:
+            WRITES_DROPPED.inc()
+            return False
+
+    def __write_batches(self):
+        while True:
+            batch = [self.__writes.get()]
+            while len(batch) < self.chunk_size:
+                try:
+                    batch.append(self.__writes.get_nowait())
+                except queue.Empty:
+                    break
+            by_expire_time = {}
+            for item in batch:
+                if item is not None:
+                    key, value, expire_time = item
+                    by_expire_time.setdefault(expire_time, {})[key] = value
+            for expire_time, values in by_expire_time.items():
+                try:
+                    # off the request path the writer can wait for NOT_STORED and SERVER_ERROR replies
+                    failed = len(self.__cache_set_many(values, expire_time, noreply=False))
+                except Exception as e:
+                    # the writer must outlive any error, or every later write would be dropped
+                    logging.warning("Write-behind of %s keys failed: %r", len(values), e)
+                    failed = len(values)
+                if failed:
+                    WRITES_FAILED.inc(value=failed)
+            for _ in batch:
+                self.__writes.task_done()
+            if None in batch:
+                return
+
+    def flush(self):
+        # waits until every queued write and refresh has been sent
+        if self.__writes is not None and self.__writer.is_alive():
+            self.__writes.join()
+        if self.read_cache is not None and self.__refresher.is_alive():
+            self.__refreshes.join()
+
+    def close(self):
+        if self.__writes is not None and self.__writer.is_alive():
+            self.__writes.put(None)
+            self.__writer.join()
+        if self.read_cache is not None and self.__refresher.is_alive():
+            self.__refreshes.put(None)
+            self.__refresher.join()
+        for client in self.__clients.values():
+            client.close()
+
+
+class AsyncMemcacheClient:
+    # speaks the memcache text protocol over asyncio streams and encodes values with the same serde
+    # objects as MemcacheClient, so both clients can share one memcache
+    def __init__(self, timeout: float = 5., chunk_size: int = 100, servers=DEFAULT_SERVERS, pool_size: int = 32,
+                 breaker: CircuitBreaker = None, serde=None, hot_keys: HotKeys = None):
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.serde = serde or LegacySerde()
+        self.hot_keys = hot_keys
+        self.chunk_size = chunk_size
+        self.__semaphores = {node: asyncio.Semaphore(pool_size) for node in map(tuple, servers)}
+        self.__idle = {node: [] for node in self.__semaphores}
+        self.__ring = HashRing(self.__semaphores)
+
+    @contextlib.asynccontextmanager
+    async def __connection(self, node):
+        async with self.__semaphores[node]:
+            idle = self.__idle[node]
+            if idle:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await deadline.wait_for(asyncio.open_connection(*node), self.timeout)
+            try:
+                yield reader, writer
+            except BaseException:
+                writer.close()
+                raise
+            idle.append((reader, writer))
+
+    async def __get_many(self, node, keys):
+        async with self.__connection(node) as (reader, writer):
+            writer.write(b"get " + b" ".join(key.encode('ascii') for key in keys) + b"\r\n")
+            await writer.drain()
+            result = {}
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise MemcacheUnexpectedCloseError()
+                if line == b"END\r\n":
+                    count_lookups(len(keys), len(result))
+                    return result
+                if not line.startswith(b"VALUE "):
+                    raise MemcacheUnknownError(line)
+                _, key, flags, size = line.split()[:4]
+                key = key.decode('ascii')
+                result[key] = self.serde.deserialize(key, (await reader.readexactly(int(size) + 2))[:-2], int(flags))
 
+    async def __get(self, key):
+        return (await self.__get_many(self.__ring.get_node(key), [key])).get(key)
 
+    async def __set_many(self, node, values, expire_time):
+        # noreply sets are pipelined in a single write
+        commands = []
+        for key, value in values.items():
+            value, flags = self.serde.serialize(key, value)
+            if not isinstance(value, bytes):
+                value = str(value).encode('utf-8')
+            commands.append(b"set %s %d %d %d noreply\r\n%s\r\n" % (key.encode('ascii'), flags, expire_time,
+                                                                    len(value), value))
+        async with self.__connection(node) as (reader, writer):
+            writer.write(b"".join(commands))
+            await writer.drain()
+        return []
 
+    async def __set(self, key, value, expire_time):
+        await self.__set_many(self.__ring.get_node(key), {key: value}, expire_time)
+        return True
+
+    async def close(self):
+        for idle in self.__idle.values():
+            while idle:
+                _, writer = idle.pop()
+                writer.close()
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    async def cache_get(self, key):
+        if self.hot_keys is not None:
+            self.hot_keys.record((key,))
+        return await deadline.wait_for(self.__get(key), self.timeout)
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    async def get(self, key):
+        if self.hot_keys is not None:
+            self.hot_keys.record((key,))
+        return await deadline.wait_for(self.__get(key), self.timeout)
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    async def get_many(self, keys):
+        if self.hot_keys is not None:
+            keys = list(keys)
+            self.hot_keys.record(keys)
+        requests = [self.__get_many(node, node_keys[i:i + self.chunk_size])
+                    for node, node_keys in self.__ring.group(keys).items()
+                    for i in range(0, len(node_keys), self.chunk_size)]
+        result = {}
+        for found in await deadline.wait_for(asyncio.gather(*requests), self.timeout):
+            result.update(found)
+        return result
+
+    async def cache_get_many(self, keys):
+        return await self.get_many(keys)
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    async def cache_set(self, key, value, expire_time: int = 60):
+        return await deadline.wait_for(self.__set(key, value, expire_time), self.timeout)
+
+    @circuit
+    @retry(ConnectionRefusedError)
+    async def cache_set_many(self, values, expire_time: int = 60):
+        requests = [self.__set_many(node, {key: values[key] for key in node_keys[i:i + self.chunk_size]}, expire_time)
+                    for node, node_keys in self.__ring.group(values).items()
+                    for i in range(0, len(node_keys), self.chunk_size)]
+        failed = []
+        for node_failed in await deadline.wait_for(asyncio.gather(*requests), self.timeout):
+            failed.extend(node_failed)
+        return failed
@@ -0,0 +1,366 @@
+import datetime
+import hashlib
+import http.client
+import io
+import json
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import api
+from ratelimit import RateLimiter
+from store import HotKeys, LocalCache, MemcacheClient
+
+
+class TestScoringHTTPServer(unittest.TestCase):
+    def setUp(self):
+        self.server = api.ScoringHTTPServer(("localhost", 0), api.MainHTTPHandler, threads=2)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_slow_client_does_not_block_others(self):
+        with socket.create_connection(("localhost", self.port)) as idle:
+            idle.sendall(b"POST /method HTTP/1.1\r\n")
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+            conn.request("GET", "/")
+            self.assertEqual(501, conn.getresponse().status)
+            conn.close()
+
+    def test_post_returns_json_bytes_with_length(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                   "arguments": {"client_ids": [1, 2]}}
+        request["token"] = hashlib.sha512((request["account"] + request["login"] + api.SALT).encode()).hexdigest()
+        self.server.store = MemcacheClient()
+        with patch.object(MemcacheClient, "get_many", return_value={"i:1": b'["books"]'}):
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+            conn.request("POST", "/method", body=json.dumps(request))
+            response = conn.getresponse()
+            body = response.read()
+            conn.close()
+        self.assertEqual(200, response.status)
+        self.assertEqual(str(len(body)), response.getheader("Content-Length"))
+        self.assertEqual({"response": {"1": ["books"], "2": []}, "code": 200}, json.loads(body))
+
+    def admin_request(self):
+        request = {"account": "horns&hoofs", "login": "admin", "method": "online_score",
+                   "arguments": {"phone": "79175002040", "email": "a@b.ru"}}
+        request["token"] = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") +
+                                           api.ADMIN_SALT).encode()).hexdigest()
+        return json.dumps(request)
+
+    def test_keepalive_serves_pipelined_requests(self):
+        body = self.admin_request().encode()
+        request = b"POST /method HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+        with socket.create_connection(("localhost", self.port), timeout=5) as sock:
+            sock.sendall(request * 2)
+            stream = sock.makefile("rb")
+            for _ in range(2):
+                self.assertEqual(b"HTTP/1.1 200 OK\r\n", stream.readline())
+                headers = {}
+                while (line := stream.readline()) != b"\r\n":
+                    name, _, value = line.decode().partition(":")
+                    headers[name.lower()] = value.strip()
+                self.assertNotIn("connection", headers)
+                payload = json.loads(stream.read(int(headers["content-length"])))
+                self.assertEqual({"score": 42}, payload["response"])
+
+    def test_connection_closed_after_max_requests(self):
+        with patch.object(api.MainHTTPHandler, "max_requests", 2):
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+            closing = []
+            for _ in range(3):
+                conn.request("POST", "/method", body=self.admin_request())
+                response = conn.getresponse()
+                response.read()
+                closing.append(response.getheader("Connection"))
+            conn.close()
+        self.assertEqual([None, "close", None], closing)
+
+    def test_single_threaded_server_closes_connections(self):
+        server = api.ScoringHTTPServer(("localhost", 0), api.MainHTTPHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = server.server_address[1]
+        idle = http.client.HTTPConnection("localhost", port, timeout=5)
+        idle.request("POST", "/method", body=self.admin_request())
+        response = idle.getresponse()
+        response.read()
+        self.assertEqual("close", response.getheader("Connection"))
+        # the idle client must not hold up the next one for the keep-alive timeout
+        conn = http.client.HTTPConnection("localhost", port, timeout=2)
+        conn.request("GET", "/metrics")
+        response = conn.getresponse()
+        response.read()
+        self.assertEqual((200, "close"), (response.status, response.getheader("Connection")))
+        conn.close()
+        idle.close()
+
+    def test_metrics(self):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/method", body=self.admin_request())
+        conn.getresponse().read()
+        conn.request("GET", "/metrics")
+        response = conn.getresponse()
+        body = response.read().decode()
+        conn.close()
+        self.assertEqual(200, response.status)
+        self.assertTrue(response.getheader("Content-Type").startswith("text/plain"))
+        self.assertRegex(body, r'scoring_requests_total\{method="online_score",code="200"\} [1-9]')
+        for stage in ("parse", "validate", "auth", "handler", "serialize"):
+            self.assertIn('scoring_stage_seconds_count{stage="%s"}' % stage, body)
+        self.assertIn('scoring_local_cache_entries{cache="auth"}', body)
+
+    def test_hot_keys(self):
+        self.server.store = MemcacheClient(hot_keys=HotKeys(sample=1))
+        self.server.store.hot_keys.record(["i:1", "i:2"])
+        self.server.store.hot_keys.record(["i:2"])
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("GET", "/hotkeys?limit=1")
+        response = conn.getresponse()
+        body = json.loads(response.read())
+        conn.close()
+        self.assertEqual("application/json", response.getheader("Content-Type"))
+        self.assertEqual({"keys": ["i:2"]}, body)
+
+    def test_hot_keys_limit_is_validated(self):
+        self.server.store = MemcacheClient(hot_keys=HotKeys(sample=1))
+        self.server.store.hot_keys.record(["i:1", "i:2"])
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        statuses = []
+        for query in ("limit=0", "limit=-1", "limit=x", "limit=", ""):
+            conn.request("GET", "/hotkeys?" + query)
+            response = conn.getresponse()
+            statuses.append((response.status, json.loads(response.read()).get("code")))
+        conn.close()
+        self.assertEqual([(400, 400)] * 4 + [(200, None)], statuses)
+
+    def test_successful_requests_are_sampled(self):
+        with patch.object(api.MainHTTPHandler, "log_sample", 0.), self.assertLogs(level="INFO") as logs:
+            conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+            conn.request("POST", "/method", body=self.admin_request())
+            conn.getresponse().read()
+            conn.request("POST", "/method", body=json.dumps({"login": "h&f", "method": "online_score"}))
+            conn.getresponse().read()
+            conn.close()
+        self.assertFalse([line for line in logs.output if "'code': 200" in line])
+        self.assertTrue([line for line in logs.output if "'code': 422" in line])
+        # validation errors come without a traceback
+        self.assertFalse([line for line in logs.output if "Traceback" in line])
+
+    def test_expired_deadline_is_answered_503(self):
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/method", body=self.admin_request(), headers={"X-Deadline-Ms": "0"})
+        response = conn.getresponse()
+        self.assertEqual((503, {"error": "Service Unavailable", "code": 503}), (response.status,
+                                                                                json.loads(response.read())))
+        conn.request("POST", "/method", body=self.admin_request(), headers={"X-Deadline-Ms": "1000"})
+        self.assertEqual(200, conn.getresponse().status)
+        conn.close()
+
+    def test_connections_over_max_queue_are_shed(self):
+        self.server.max_queue = 1
+        # as if a connection already waited for a thread
+        self.server.queued = 1
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/method", body=self.admin_request())
+        response = conn.getresponse()
+        self.assertEqual((503, "close"), (response.status, response.getheader("Connection")))
+        self.assertEqual(503, json.loads(response.read())["code"])
+        conn.close()
+        self.server.queued = 0
+        conn = http.client.HTTPConnection("localhost", self.port, timeout=5)
+        conn.request("POST", "/method", body=self.admin_request())
+        self.assertEqual(200, conn.getresponse().status)
+        conn.close()
+
+
+class TestMethodHandler(unittest.TestCase):
+    def setUp(self):
+        self.context = {}
+        self.store = MemcacheClient()
+
+    def get_response(self, request):
+        return api.method_handler({"body": request, "headers": {}}, self.context, self.store)
+
+    @staticmethod
+    def set_valid_auth(request):
+        request["token"] = hashlib.sha512((request["account"] + request["login"] + api.SALT).encode()).hexdigest()
+        return request
+
+    def test_online_score_batch(self):
+        request = self.set_valid_auth({"account": "horns&hoofs", "login": "h&f", "method": "online_score_batch",
+                                       "arguments": {"items": [{"phone": "79175002040", "email": "a@b.ru"},
+                                                               {"phone": "79175002040"},
+                                                               {"phone": "79175002040", "email": "a@b.ru"}]}})
+        with patch.object(MemcacheClient, "cache_get_many", return_value={}) as cache_get_many, \
+                patch.object(MemcacheClient, "cache_set_many", return_value=[]) as cache_set_many:
+            response, code = self.get_response(request)
+        self.assertEqual(api.OK, code)
+        self.assertEqual({"score": 3.0}, response["scores"][0])
+        self.assertIn("error", response["scores"][1])
+        self.assertEqual({"score": 3.0}, response["scores"][2])
+        # current keys, then the legacy keys of the misses
+        self.assertEqual(2, cache_get_many.call_count)
+        self.assertEqual(1, cache_set_many.call_count)
+        self.assertEqual({"method": "online_score_batch", "nitems": 3, "nvalid": 2}, self.context)
+
+    def test_rate_limit_runs_before_validation(self):
+        request = self.set_valid_auth({"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                                       "arguments": {}})
+        limits = {"logins": {"h&f": {"rate": 0, "burst": 3}}, "unverified": {"rate": 0, "burst": 2}}
+        with patch.object(api, "AUTH_CACHE", LocalCache()), patch.object(api, "RATE_LIMITER", RateLimiter(limits)):
+            # the first request is verified by check_auth, the second one by the auth cache
+            self.assertEqual([api.INVALID_REQUEST] * 2, [self.get_response(request)[1] for _ in range(2)])
+            # bad tokens use up the unverified bucket of the login, not the partner's
+            self.assertEqual([api.FORBIDDEN, api.TOO_MANY_REQUESTS],
+                             [self.get_response(dict(request, token="bad"))[1] for _ in range(2)])
+            self.assertEqual([api.INVALID_REQUEST, api.TOO_MANY_REQUESTS],
+                             [self.get_response(request)[1] for _ in range(2)])
+
+    def test_rate_limit_without_auth_cache(self):
+        request = self.set_valid_auth({"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                                       "arguments": {}})
+        limiter = RateLimiter({"logins": {"h&f": {"rate": 0, "burst": 1}}})
+        with patch.object(api, "AUTH_CACHE", None), patch.object(api, "RATE_LIMITER", limiter):
+            # the login is charged once check_auth has accepted the token
+            self.assertEqual([api.INVALID_REQUEST, api.TOO_MANY_REQUESTS, api.FORBIDDEN],
+                             [self.get_response(body)[1] for body in (request, request, dict(request, token="bad"))])
+
+    def test_bad_tokens_do_not_limit_other_logins(self):
+        request = self.set_valid_auth({"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                                       "arguments": {}})
+        limiter = RateLimiter({"unverified": {"rate": 0, "burst": 2}})
+        with patch.object(api, "AUTH_CACHE", LocalCache()), patch.object(api, "RATE_LIMITER", limiter):
+            self.assertEqual([api.FORBIDDEN] * 2 + [api.TOO_MANY_REQUESTS] * 3,
+                             [self.get_response(dict(request, login="victim", token="bad"))[1] for _ in range(5)])
+            # not in the auth cache yet
+            self.assertEqual(api.INVALID_REQUEST, self.get_response(request)[1])
+
+    def test_rate_limit_without_auth_cache_keeps_logins_apart(self):
+        limiter = RateLimiter({"unverified": {"rate": 0, "burst": 1}})
+        requests = [self.set_valid_auth({"account": "horns&hoofs", "login": "login%d" % i, "method": "online_score",
+                                         "arguments": {}}) for i in range(20)]
+        with patch.object(api, "AUTH_CACHE", None), patch.object(api, "RATE_LIMITER", limiter):
+            # every request is unverified, each partner still has a bucket of its own
+            self.assertEqual([api.INVALID_REQUEST] * 20, [self.get_response(request)[1] for request in requests])
+            self.assertEqual(api.TOO_MANY_REQUESTS, self.get_response(requests[0])[1])
+
+    def test_invalid_online_score_batch(self):
+        request = self.set_valid_auth({"account": "horns&hoofs", "login": "h&f", "method": "online_score_batch",
+                                       "arguments": {"items": []}})
+        self.assertEqual(api.INVALID_REQUEST, self.get_response(request)[1])
+
+
+class TestCheckAuth(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(api, "AUTH_CACHE", api.LocalCache(max_entries=10))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_verified_credentials_are_cached(self):
+        token = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode()).hexdigest()
+        request = api.MethodRequest(account="horns&hoofs", login="h&f", token=token, arguments={}, method="m")
+        with patch("hashlib.sha512", wraps=hashlib.sha512) as sha512:
+            self.assertTrue(api.check_auth(request))
+            self.assertTrue(api.check_auth(request))
+            self.assertEqual(1, sha512.call_count)
+
+    def test_invalid_credentials_are_not_cached(self):
+        request = api.MethodRequest(account="horns&hoofs", login="h&f", token="bad", arguments={}, method="m")
+        self.assertFalse(api.check_auth(request))
+        self.assertEqual(0, len(api.AUTH_CACHE))
+
+    def test_admin_credentials_expire_at_hour_boundary(self):
+        issued = datetime.datetime(2026, 10, 16, 21, 59, 30)
+        token = hashlib.sha512((issued.strftime("%Y%m%d%H") + api.ADMIN_SALT).encode()).hexdigest()
+        request = api.MethodRequest(account="", login=api.ADMIN_LOGIN, token=token, arguments={}, method="m")
+        with patch("api.datetime") as _datetime, patch("time.monotonic", return_value=0):
+            _datetime.datetime.now.return_value = issued
+            self.assertTrue(api.check_auth(request))
+        with patch("api.datetime") as _datetime, patch("time.monotonic", return_value=29):
+            _datetime.datetime.now.return_value = issued + datetime.timedelta(seconds=29)
+            self.assertTrue(api.check_auth(request))
+            self.assertEqual(0, _datetime.datetime.now.call_count)
+        with patch("api.datetime") as _datetime, patch("time.monotonic", return_value=31):
+            _datetime.datetime.now.return_value = issued + datetime.timedelta(seconds=31)
+            self.assertFalse(api.check_auth(request))
+
+
+class TestReplay(unittest.TestCase):
+    def test_responses_keep_input_order(self):
+        requests = []
+        for i in range(50):
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                       "arguments": {"first_name": f"name{i}", "last_name": "x"}}
+            request["token"] = hashlib.sha512((request["account"] + request["login"] + api.SALT).encode()).hexdigest()
+            requests.append(json.dumps(request))
+        requests[7] = "{not json"
+        requests[9] = json.dumps({"login": "h&f", "method": "online_score", "token": "", "account": "",
+                                  "arguments": {}})
+        source = io.StringIO("\n".join(requests) + "\n\n")
+        destination = io.StringIO()
+
+        with patch.object(MemcacheClient, "cache_get", side_effect=lambda key: None), \
+                patch.object(MemcacheClient, "cache_set", return_value=True):
+            api.replay(source, destination, MemcacheClient(), workers=4, window=8)
+
+        responses = [json.loads(line) for line in destination.getvalue().splitlines()]
+        self.assertEqual(50, len(responses))
+        self.assertEqual(api.BAD_REQUEST, responses[7]["code"])
+        self.assertEqual(api.FORBIDDEN, responses[9]["code"])
+        self.assertEqual({"response": {"score": 0.5}, "code": api.OK}, responses[0])
+        self.assertEqual(48, sum(response["code"] == api.OK for response in responses))
+
+
+class ClosingStore:
+    # records in a file that the worker process closed its store
+    def __init__(self, directory):
+        self.directory = directory
+        open(os.path.join(directory, "ready-%d" % os.getpid()), "w").close()
+
+    def close(self):
+        open(os.path.join(self.directory, "closed-%d" % os.getpid()), "w").close()
+
+
+class TestWorkers(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(signal.signal, signal.SIGTERM, signal.getsignal(signal.SIGTERM))
+
+    def terminate_when_ready(self, workers):
+        for _ in range(500):
+            if len([name for name in os.listdir(self.directory) if name.startswith("ready")]) == workers:
+                break
+            time.sleep(.01)
+        time.sleep(.1)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def test_sigterm_stops_worker_and_closes_store(self):
+        server = api.ScoringHTTPServer(("localhost", 0), api.MainHTTPHandler, threads=2)
+        threading.Thread(target=self.terminate_when_ready, args=(1,)).start()
+        api.run_worker(server, lambda: ClosingStore(self.directory))
+        self.assertEqual(["closed-%d" % os.getpid()],
+                         [name for name in os.listdir(self.directory) if name.startswith("closed")])
+
+    def test_sigterm_to_master_stops_workers(self):
+        server = api.ScoringHTTPServer(("localhost", 0), api.MainHTTPHandler)
+        threading.Thread(target=self.terminate_when_ready, args=(2,)).start()
+        api.serve(server, workers=2, store_factory=lambda: ClosingStore(self.directory))
+        self.assertEqual(2, len([name for name in os.listdir(self.directory) if name.startswith("closed")]))
+
+
+if __name__ == "__main__":
+    unittest.main()
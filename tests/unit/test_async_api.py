@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import json
+import socket
+import unittest
+from unittest.mock import patch
+
+import api
+import async_api
+from store import AsyncMemcacheClient
+from bench.memcache import MemcacheStub
+
+
+class TestAsyncHTTPServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.memcache = MemcacheStub().__enter__()
+        self.store = AsyncMemcacheClient(timeout=1., servers=[self.memcache.address])
+        self.sock = socket.create_server(("localhost", 0))
+        self.server_task = asyncio.create_task(async_api.serve(self.sock, self.store))
+        self.reader, self.writer = await asyncio.open_connection(*self.sock.getsockname()[:2])
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        self.server_task.cancel()
+        await asyncio.gather(self.server_task, return_exceptions=True)
+        self.memcache.__exit__(None, None, None)
+
+    async def post(self, body, headers=b""):
+        data = json.dumps(body).encode()
+        self.writer.write(b"POST /method HTTP/1.1\r\nHost: localhost\r\n%sContent-Length: %d\r\n\r\n%s"
+                          % (headers, len(data), data))
+        await self.writer.drain()
+        status = await self.reader.readline()
+        headers = {}
+        while (line := await self.reader.readline()) != b"\r\n":
+            name, _, value = line.decode().partition(":")
+            headers[name.lower()] = value.strip()
+        payload = json.loads(await self.reader.readexactly(int(headers["content-length"])))
+        return int(status.split()[1]), payload
+
+    @staticmethod
+    def with_token(body):
+        body["token"] = hashlib.sha512((body["account"] + body["login"] + api.SALT).encode()).hexdigest()
+        return body
+
+    async def test_online_score(self):
+        body = self.with_token({"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                                "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}})
+        self.assertEqual((200, {"response": {"score": 3.0}, "code": 200}), await self.post(body))
+        # the connection is kept alive, the second answer comes from the cache
+        self.assertEqual((200, {"response": {"score": 3.0}, "code": 200}), await self.post(body))
+
+    async def test_online_score_batch(self):
+        body = self.with_token({"account": "horns&hoofs", "login": "h&f", "method": "online_score_batch",
+                                "arguments": {"items": [{"phone": "79175002040", "email": "stupnikov@otus.ru"},
+                                                        {"gender": 1}]}})
+        code, payload = await self.post(body)
+        self.assertEqual(200, code)
+        self.assertEqual({"score": 3.0}, payload["response"]["scores"][0])
+        self.assertIn("error", payload["response"]["scores"][1])
+
+    async def test_clients_interests(self):
+        await self.store.cache_set("i:1", json.dumps(["books", "music"]), 60)
+        body = self.with_token({"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                                "arguments": {"client_ids": [1, 2]}})
+        self.assertEqual((200, {"response": {"1": ["books", "music"], "2": []}, "code": 200}), await self.post(body))
+
+    async def test_forbidden(self):
+        body = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "",
+                "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}
+        self.assertEqual((403, {"error": "Forbidden", "code": 403}), await self.post(body))
+
+    async def test_expired_deadline(self):
+        body = self.with_token({"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                                "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}})
+        self.assertEqual((503, {"error": "Service Unavailable", "code": 503}),
+                         await self.post(body, b"X-Deadline-Ms: 0\r\n"))
+        # the connection stays usable
+        self.assertEqual(200, (await self.post(body, b"X-Deadline-Ms: 1000\r\n"))[0])
+
+    async def test_memcache_slower_than_deadline(self):
+        async def get_many(self, node, keys):
+            await asyncio.sleep(1)
+
+        body = self.with_token({"account": "horns&hoofs", "login": "h&f", "method": "clients_interests",
+                                "arguments": {"client_ids": [1, 2]}})
+        with patch.object(AsyncMemcacheClient, "_AsyncMemcacheClient__get_many", get_many):
+            for _ in range(self.store.breaker.failure_threshold + 1):
+                self.assertEqual((503, {"error": "Service Unavailable", "code": 503}),
+                                 await self.post(body, b"X-Deadline-Ms: 20\r\n"))
+        # running out of time is the request's failure, not memcache's
+        self.assertEqual(0, self.store.breaker.failures)
+        self.assertEqual(200, (await self.post(body))[0])
+
+    async def test_connection_closed_after_max_requests(self):
+        sock = socket.create_server(("localhost", 0))
+        task = asyncio.create_task(async_api.serve(sock, self.store, timeout=.2, max_requests=2))
+        reader, writer = await asyncio.open_connection(*sock.getsockname()[:2])
+        request = b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n"
+        writer.write(request * 2)
+        responses = await reader.read()
+        writer.close()
+        self.assertEqual([b"keep-alive", b"close"], [line.split()[1] for line in responses.splitlines()
+                                                     if line.startswith(b"Connection:")])
+        # an idle connection is dropped after the timeout
+        reader, writer = await asyncio.open_connection(*sock.getsockname()[:2])
+        self.assertEqual(b"", await asyncio.wait_for(reader.read(), 2))
+        writer.close()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def test_hot_keys_limit_is_validated(self):
+        sock = socket.create_server(("localhost", 0))
+        task = asyncio.create_task(async_api.serve(sock, self.store, timeout=.2, max_requests=2))
+        reader, writer = await asyncio.open_connection(*sock.getsockname()[:2])
+        writer.write(b"GET /hotkeys?limit=0 HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                     b"GET /hotkeys?limit=1 HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        responses = await reader.read()
+        writer.close()
+        # the bodies end without a newline
+        self.assertEqual([b"400", b"200"], [status[:3] for status in responses.split(b"HTTP/1.1 ")[1:]])
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
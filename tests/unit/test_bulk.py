@@ -0,0 +1,78 @@
+import io
+import itertools
+import random
+import unittest
+from unittest.mock import Mock
+
+import api
+import bulk
+from scoring import compute_score, score_key
+
+CELLS = {
+    "first_name": ["", "Стансилав", "a"],
+    "last_name": ["", "Ступников"],
+    "email": ["", "stupnikov@otus.ru", "stupnikov.otus.ru"],
+    "phone": ["", "79175002040", "89175002040", "7917500204", "791750020400"],
+    "birthday": ["", "01.01.1990", "29.02.2000", "29.02.1900", "31.04.2000", "00.01.2000", "1.1.1990", "01.01.1900",
+                 "31.12.9999", "2000-01-01", "01.01.0000", "０１.01.1990", "01.01.1990 "],
+    "gender": ["", "0", "1", "2", "3", "male"],
+    }
+
+
+def online_score(row):
+    # what online_score does with the same fields: (valid, score, key)
+    values = {field: value for field, value in row.items() if value != ""}
+    if values.get("gender") in ("0", "1", "2"):
+        values["gender"] = int(values["gender"])
+    try:
+        request = api.OnlineScoreRequest(**values)
+    except ValueError:
+        return False, None, None
+    fields = {field: getattr(request, field) for field in bulk.FIELDS}
+    return True, compute_score(**fields), score_key(**fields)
+
+
+@unittest.skipIf(bulk.np is None, "numpy is not installed")
+class TestBulkScoring(unittest.TestCase):
+    def make_rows(self, count):
+        rnd = random.Random(24)
+        return [{field: rnd.choice(cells) for field, cells in CELLS.items()} for _ in range(count)]
+
+    def test_scores_match_online_score(self):
+        rows = self.make_rows(3000)
+        valid, scores, _ = bulk.score_columns({field: [row[field] for row in rows] for field in bulk.FIELDS})
+        for row, ok, score in zip(rows, valid.tolist(), scores.tolist()):
+            expected_ok, expected_score, _ = online_score(row)
+            self.assertEqual(expected_ok, ok, row)
+            if ok:
+                self.assertEqual(expected_score, score, row)
+        self.assertTrue(valid.any() and not valid.all())
+
+    def test_csv_in_chunks_and_push(self):
+        rows = self.make_rows(500)
+        fields = ["phone", "email", "gender", "birthday", "first_name", "last_name"]
+        source = io.StringIO("\n".join(itertools.chain([",".join(fields)],
+                                                       (",".join(row[field] for field in fields) for row in rows))))
+        destination = io.StringIO()
+        store = Mock()
+        self.assertEqual((500, sum(not online_score(row)[0] for row in rows)),
+                         bulk.run(source, destination, chunk_size=64, store=store))
+
+        lines = destination.getvalue().splitlines()
+        self.assertEqual(["score"] + [repr(float(online_score(row)[1])) if online_score(row)[0] else ""
+                                      for row in rows], lines)
+        pushed = {}
+        for args, kwargs in store.cache_set_many.call_args_list:
+            self.assertEqual(60 * 60, args[1])
+            pushed.update(args[0])
+        self.assertEqual(8, store.cache_set_many.call_count)
+        expected = {}
+        for row in rows:
+            ok, score, key = online_score(row)
+            if ok:
+                expected[key] = float(score)
+        self.assertEqual(expected, pushed)
+
+
+if __name__ == "__main__":
+    unittest.main()
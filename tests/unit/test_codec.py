@@ -0,0 +1,30 @@
+import unittest
+
+import codec
+from tests.utils import cases
+
+
+class TestCodec(unittest.TestCase):
+    def tearDown(self):
+        codec.use()
+
+    @cases(list(codec.BACKENDS))
+    def test_dumps_bytes(self, backend):
+        codec.use(backend)
+        encoded = codec.dumps({"response": {1: ["книги", "cars"], 2: []}, "code": 200})
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual({"response": {"1": ["книги", "cars"], "2": []}, "code": 200}, codec.loads(encoded))
+
+    @cases(list(codec.BACKENDS))
+    def test_loads_invalid(self, backend):
+        codec.use(backend)
+        with self.assertRaises(ValueError):
+            codec.loads(b"{not json")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            codec.use("simplejson")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -118,6 +118,31 @@ class Fields(unittest.TestCase):
             with self.assertRaises(ValueError):
                 fields.x = value
 
+    @cases(["18.05.1995", "1.5.1995", "01.5.1995", "29.02.2000", " 1.05.1995", "05.18.1995", "29.02.1999",
+            "+1.05.1995", "18.05.995", "18-05-1995", "18.05.1995 ", "00.05.1995", "18.05.0000"])
+    def test_parse_date_matches_strptime(self, value):
+        try:
+            expected = datetime.datetime.strptime(value, '%d.%m.%Y')
+        except ValueError:
+            expected = ValueError
+        try:
+            result = api.parse_date(value)
+        except ValueError:
+            result = ValueError
+        self.assertEqual(expected, result, value)
+
+    def test_birthday_boundary_matches_70_years(self):
+        field = api.BirthDayField(name="x")
+        now = datetime.datetime.now()
+        for days in range(25560, 25575):
+            value = (now - datetime.timedelta(days=days)).strftime('%d.%m.%Y')
+            too_old = (now - datetime.datetime.strptime(value, '%d.%m.%Y')).days / 365.25 > 70
+            if too_old:
+                with self.assertRaises(ValueError):
+                    field.clean(value)
+            else:
+                self.assertEqual(datetime.datetime.strptime(value, '%d.%m.%Y'), field.clean(value))
+
     @cases([0, 1, 2])
     def test_ok_gender_field(self, value):
         with patch.object(self.TestFields, "x", api.GenderField(name="x")):
@@ -146,6 +171,20 @@ class Fields(unittest.TestCase):
             with self.assertRaises(ValueError):
                 fields.x = value
 
+    @cases([[{}], [{"phone": "79123565900"}, {"first_name": "a"}]])
+    def test_ok_arguments_list_field(self, value):
+        with patch.object(self.TestFields, "x", api.ArgumentsListField(name="x")):
+            fields = self.TestFields()
+            fields.x = value
+            self.assertEqual(value, fields.x, value)
+
+    @cases([1, "some_string", {}, [], [1], [{}, []], [None]])
+    def test_invalid_arguments_list_field(self, value):
+        with patch.object(self.TestFields, "x", api.ArgumentsListField(name="x")):
+            fields = self.TestFields()
+            with self.assertRaises(ValueError):
+                fields.x = value
+
 
 class RequestFields(unittest.TestCase):
     @cases([
@@ -247,6 +286,55 @@ class RequestFields(unittest.TestCase):
         with self.assertRaises(ValueError):
             api.ClientsInterestsRequest(**init_vars)
 
+    def test_request_values_are_stored_in_slots(self):
+        fields = api.MethodRequest(login="a&p", token="", arguments={}, method="test")
+        self.assertFalse(hasattr(fields, "__dict__"))
+        self.assertEqual(("account", "login", "token", "arguments", "method"), api.MethodRequest.__slots__)
+
+    def test_subclass_inherits_fields(self):
+        class TracedMethodRequest(api.MethodRequest):
+            trace_id = api.CharField(name="trace_id", required=False, nullable=True)
+            # a redeclared field keeps its place and the slot of the base
+            account = api.CharField(name="account", required=True, nullable=False)
+
+        self.assertEqual(["account", "login", "token", "arguments", "method", "trace_id"],
+                         list(TracedMethodRequest.fields))
+        fields = TracedMethodRequest(account="h", login="a&p", token="", arguments={}, method="test", trace_id="1")
+        self.assertEqual(("h", "a&p", "test", "1"), (fields.account, fields.login, fields.method, fields.trace_id))
+        self.assertFalse(hasattr(fields, "__dict__"))
+        with self.assertRaises(ValueError):
+            TracedMethodRequest(login="a&p", token="", arguments={}, method="test")
+
+    def test_unexpected_request_field(self):
+        with self.assertRaises(TypeError):
+            api.ClientsInterestsRequest(client_ids=[1], unknown=1)
+
+    @cases([
+        ({"login": None, "token": None, "arguments": None, "method": None}, "field 'method' can not be nullable"),
+        ({"token": None, "arguments": None, "method": "m"}, "field 'login' is required"),
+        ({"login": 1, "token": 1, "arguments": None, "method": "m"}, "field 'login' must be string"),
+        ])
+    def test_method_field_errors(self, init_vars: dict, message):
+        with self.assertRaisesRegex(ValueError, message):
+            api.MethodRequest(**init_vars)
+
+    def test_online_score_batch_items(self):
+        fields = api.OnlineScoreBatchRequest(items=[{"first_name": "Lewis", "last_name": "Hamilton"},
+                                                    {"first_name": "Lewis"},
+                                                    {"phone": "79034852532", "email": "no-reply@otus.ru"},
+                                                    {"phone": "79034852532", "unknown": 1}])
+        results, valid = fields.validate_items()
+        self.assertEqual([0, 2], list(valid))
+        self.assertEqual("Hamilton", valid[0].last_name)
+        self.assertIsNone(results[0])
+        self.assertIn("error", results[1])
+        self.assertIn("error", results[3])
+
+    @cases([{}, {"items": []}, {"items": [{}] * (api.MAX_BATCH_SIZE + 1)}])
+    def test_invalid_online_score_batch(self, init_vars: dict):
+        with self.assertRaises(ValueError):
+            api.OnlineScoreBatchRequest(**init_vars)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,62 @@
+import io
+import logging
+import threading
+import unittest
+
+import logqueue
+
+
+class TestQueueHandler(unittest.TestCase):
+    def make_logger(self, handler):
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        logger = logging.getLogger("test_logqueue.%s" % id(handler))
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        self.addCleanup(handler.close)
+        return logger
+
+    def test_records_are_written_in_order(self):
+        stream = io.StringIO()
+        logger = self.make_logger(logqueue.QueueHandler(stream))
+        for i in range(1000):
+            logger.info("request %s", i)
+        logger.handlers[0].flush()
+        self.assertEqual(["INFO request %s" % i for i in range(1000)], stream.getvalue().splitlines())
+
+    def test_traceback_is_rendered_by_caller(self):
+        stream = io.StringIO()
+        logger = self.make_logger(logqueue.QueueHandler(stream))
+        try:
+            raise KeyError("method")
+        except KeyError:
+            logger.exception("Unexpected error")
+        logger.handlers[0].flush()
+        self.assertTrue(stream.getvalue().startswith("ERROR Unexpected error\nTraceback"))
+        self.assertIn("KeyError: 'method'", stream.getvalue())
+
+    def test_full_queue_drops_records(self):
+        release = threading.Event()
+
+        class BlockedStream(io.StringIO):
+            def write(self, s):
+                release.wait(5)
+                return super().write(s)
+
+        stream = BlockedStream()
+        handler = logqueue.QueueHandler(stream, max_size=10)
+        logger = self.make_logger(handler)
+        dropped = logqueue.DROPPED.collect().get((), 0)
+        for i in range(100):
+            logger.info("request %s", i)
+        release.set()
+        handler.flush()
+        # the writer holds at most one batch, the queue at most max_size records
+        written = len(stream.getvalue().splitlines())
+        self.assertLessEqual(written, 20)
+        self.assertEqual(100, written + handler.dropped)
+        self.assertEqual(dropped + handler.dropped, logqueue.DROPPED.collect()[()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import threading
+import unittest
+
+import metrics
+
+
+class TestCounter(unittest.TestCase):
+    def test_shards_are_summed(self):
+        counter = metrics.Counter("requests_total", "Requests.", ("method", "code"), registry=None)
+
+        def work():
+            for _ in range(1000):
+                counter.inc("online_score", 200)
+            counter.inc("clients_interests", 403, value=2)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({("online_score", 200): 4000, ("clients_interests", 403): 8}, counter.collect())
+
+    def test_render(self):
+        registry = []
+        counter = metrics.Counter("requests_total", "Requests.", ("method",), registry=registry)
+        counter.inc('say "hi"\n')
+        self.assertEqual('# HELP requests_total Requests.\n'
+                         '# TYPE requests_total counter\n'
+                         'requests_total{method="say \\"hi\\"\\n"} 1\n', metrics.render(registry))
+
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("stage_seconds", "Stages.", ("stage",), buckets=(.1, 1.), registry=None)
+        for value in (.05, .1, .5, 2.):
+            histogram.observe(value, "parse")
+        samples = [(name, labels, value) for name, labels, value in histogram.samples()]
+        self.assertEqual([
+            ("stage_seconds_bucket", '{stage="parse",le="0.1"}', 2),
+            ("stage_seconds_bucket", '{stage="parse",le="1.0"}', 3),
+            ("stage_seconds_bucket", '{stage="parse",le="+Inf"}', 4),
+            ("stage_seconds_sum", '{stage="parse"}', 2.65),
+            ("stage_seconds_count", '{stage="parse"}', 4),
+            ], samples)
+
+    def test_threads_observe_without_losing_samples(self):
+        histogram = metrics.Histogram("stage_seconds", "Stages.", registry=None)
+        threads = [threading.Thread(target=lambda: [histogram.observe(.001) for _ in range(1000)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # bucket counts, the sum is the last item
+        self.assertEqual(4000, sum(histogram.collect()[()][:-1]))
+
+
+class TestCallbackMetric(unittest.TestCase):
+    def test_values_are_read_at_scrape(self):
+        values = {("auth",): 1}
+        metric = metrics.CallbackMetric("cache_entries", "Entries.", lambda: values, ("cache",), registry=None)
+        values[("auth",)] = 5
+        self.assertEqual([("cache_entries", '{cache="auth"}', 5)], list(metric.samples()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import patch
+
+from ratelimit import RateLimiter
+from store import MemcacheClient
+from bench.memcache import MemcacheStub
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_bucket_refills_at_rate(self):
+        limiter = RateLimiter({"default": {"rate": 1, "burst": 2}})
+        with patch("time.monotonic", return_value=0):
+            self.assertEqual([True, True, False], [limiter.allow("horns&hoofs", "h&f") for _ in range(3)])
+            # another login has a bucket of its own
+            self.assertTrue(limiter.allow("horns&hoofs", "other"))
+        with patch("time.monotonic", return_value=1):
+            self.assertEqual([True, False], [limiter.allow("horns&hoofs", "h&f") for _ in range(2)])
+
+    def test_login_limit_wins_over_account_limit(self):
+        limiter = RateLimiter({"accounts": {"horns&hoofs": {"rate": 0, "burst": 2}},
+                               "logins": {"admin": {"rate": 0, "burst": 3}}})
+        with patch("time.monotonic", return_value=0):
+            # logins of one account share its bucket
+            self.assertEqual([True, True, False], [limiter.allow("horns&hoofs", login) for login in ("a", "b", "c")])
+            self.assertEqual(3, sum(limiter.allow("horns&hoofs", "admin") for _ in range(5)))
+            # no default: logins of other accounts are not limited
+            self.assertTrue(all(limiter.allow("otus", "a") for _ in range(10)))
+
+    def test_unverified_requests_have_a_bucket_per_login(self):
+        limiter = RateLimiter({"default": {"rate": 0, "burst": 2}})
+        with patch("time.monotonic", return_value=0):
+            # the default limit, apart from the bucket of verified requests
+            self.assertEqual([True, True, False],
+                             [limiter.allow("horns&hoofs", "a", verified=False) for _ in range(3)])
+            self.assertTrue(limiter.allow("horns&hoofs", "b", verified=False))
+            self.assertTrue(limiter.allow("horns&hoofs", "a"))
+        limiter = RateLimiter({"logins": {"h&f": {"rate": 0, "burst": 1}}})
+        self.assertTrue(all(limiter.allow("horns&hoofs", "h&f", verified=False) for _ in range(5)))
+
+    def test_idle_buckets_are_evicted(self):
+        limiter = RateLimiter({"default": {"rate": 1, "burst": 1}}, max_keys=2)
+        with patch("time.monotonic", return_value=0):
+            self.assertTrue(limiter.allow(None, "a"))
+            self.assertTrue(limiter.allow(None, "b"))
+        with patch("time.monotonic", return_value=.5):
+            # both buckets are in use, the oldest goes
+            self.assertTrue(limiter.allow(None, "c"))
+            self.assertTrue(limiter.allow(None, "a"))
+            self.assertFalse(limiter.allow(None, "c"))
+
+    def test_processes_share_counters_through_memcache(self):
+        limits = {"default": {"rate": .1, "burst": 5}}
+        with MemcacheStub() as memcache:
+            store = MemcacheClient(timeout=1., servers=[memcache.address])
+            # sync() is called by hand, the background threads wait for an hour
+            first, second = (RateLimiter(limits, store=store, sync_interval=3600) for _ in range(2))
+            self.assertTrue(all(first.allow(None, "h&f") for _ in range(3)))
+            self.assertTrue(all(second.allow(None, "h&f") for _ in range(4)))
+            # both syncs fall into one window
+            with patch("time.time", return_value=1000.):
+                first.sync()
+                second.sync()
+            # the window allows .1 * 10 + 5 requests, 7 were admitted: the second process is blocked
+            # although its own bucket still has a token
+            self.assertTrue(first.allow(None, "h&f"))
+            self.assertFalse(second.allow(None, "h&f"))
+            first.close()
+            second.close()
+            store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,15 @@
 import datetime
 import json
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import call, patch
 
-from store import MemcacheClient
+from store import LocalCache, MemcacheClient
+from bench.memcache import MemcacheStub
 from tests.utils import cases
-from scoring import get_score, get_interests
+import scoring
+from scoring import get_score, get_scores, get_interests, get_interests_many, legacy_score_key, score_key
 
 
 class TestScoring(unittest.TestCase):
@@ -48,15 +52,110 @@ class TestScoring(unittest.TestCase):
          "birthday": datetime.datetime.strptime("12.05.1995", '%d.%m.%Y'), "gender": 2}, 5),
         ])
     def test_get_score_with_available_store(self, score_vars, expected_result):
-        with patch.object(MemcacheClient, "cache_get", side_effect=[None, expected_result]) as cache_get:
+        # a miss is looked up under the current and the legacy key
+        with patch.object(MemcacheClient, "cache_get", side_effect=[None, None, expected_result]) as cache_get:
             with patch.object(MemcacheClient, "cache_set", return_value=True) as cache_set:
                 store = MemcacheClient()
                 self.assertEqual(expected_result, get_score(store, **score_vars))
                 self.assertEqual(expected_result, get_score(store, **score_vars))
 
-                self.assertEqual(2, cache_get.call_count)
+                self.assertEqual(3, cache_get.call_count)
                 self.assertEqual(1, cache_set.call_count)
 
+    def test_concurrent_get_score_shares_one_lookup(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_get(key):
+            started.set()
+            release.wait(5)
+
+        with patch.object(MemcacheClient, "cache_get", side_effect=slow_get) as cache_get, \
+                patch.object(MemcacheClient, "cache_set", return_value=True) as cache_set:
+            store = MemcacheClient()
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(get_score(store, phone="79175002040",
+                                                                                email="a@b.ru")))
+                       for _ in range(8)]
+            threads[0].start()
+            started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            time.sleep(.1)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual([3.0] * 8, results)
+        # the current and the legacy key, once
+        self.assertEqual(2, cache_get.call_count)
+        self.assertEqual(1, cache_set.call_count)
+
+    def test_get_scores_dedupes_keys(self):
+        cached_key = score_key(phone="79034852532", email="no-reply@otus.ru")
+        items = [{"first_name": "Lewis", "last_name": "Hamilton"},
+                 {"phone": "79034852532", "email": "no-reply@otus.ru"},
+                 {"first_name": "Lewis", "last_name": "Hamilton"}]
+        with patch.object(MemcacheClient, "cache_get_many", side_effect=[{cached_key: b"4.5"}, {}]) as cache_get_many:
+            with patch.object(MemcacheClient, "cache_set_many", return_value=[]) as cache_set_many:
+                store = MemcacheClient()
+                self.assertEqual([0.5, 4.5, 0.5], get_scores(store, items))
+                self.assertEqual(2, len(cache_get_many.call_args_list[0].args[0]))
+                # the miss is looked up once more under its legacy key
+                self.assertEqual({legacy_score_key(first_name="Lewis", last_name="Hamilton")},
+                                 set(cache_get_many.call_args_list[1].args[0]))
+                self.assertEqual({score_key(first_name="Lewis", last_name="Hamilton"): 0.5},
+                                 cache_set_many.call_args.args[0])
+
+    def test_get_scores_bypass_interests_read_cache(self):
+        items = [{"phone": "79034852532", "email": "no-reply@otus.ru"}]
+        with MemcacheStub() as memcache:
+            store = MemcacheClient(servers=[memcache.address], read_cache=LocalCache(ttl=60))
+            with patch.object(store, "cache_set_many", wraps=store.cache_set_many) as cache_set_many:
+                for _ in range(3):
+                    self.assertEqual([3.0], get_scores(store, items))
+            store.close()
+        # the score is written once and found afterwards, misses of score keys are not remembered
+        self.assertEqual(1, cache_set_many.call_count)
+        self.assertEqual(0, len(store.read_cache))
+
+    def test_get_scores_copies_legacy_hits(self):
+        items = [{"phone": "79034852532", "email": "no-reply@otus.ru"}, {"phone": "79034852532"}]
+        legacy = {legacy_score_key(phone="79034852532"): b"3.0"}
+        with patch.object(MemcacheClient, "cache_get_many", side_effect=[{}, legacy]), \
+                patch.object(MemcacheClient, "cache_set_many", return_value=[]) as cache_set_many:
+            self.assertEqual([3.0, 3.0], get_scores(MemcacheClient(), items))
+        # both current keys share the legacy one, which ignores email
+        self.assertEqual({score_key(**item): 3.0 for item in items}, cache_set_many.call_args.args[0])
+
+    def test_get_score_copies_legacy_hit(self):
+        values = {legacy_score_key(phone="79034852532"): b"4.5"}
+        with patch.object(MemcacheClient, "cache_get", side_effect=values.get) as cache_get, \
+                patch.object(MemcacheClient, "cache_set", return_value=True) as cache_set:
+            self.assertEqual(4.5, get_score(MemcacheClient(), phone="79034852532"))
+            # with the fallback off the legacy value is not seen, the score is computed
+            with patch.object(scoring, "LEGACY_KEYS", False):
+                self.assertEqual(1.5, get_score(MemcacheClient(), phone="79034852532"))
+        self.assertEqual(3, cache_get.call_count)
+        self.assertEqual([call(score_key(phone="79034852532"), 4.5, 60 * 60),
+                          call(score_key(phone="79034852532"), 1.5, 60 * 60)], cache_set.call_args_list)
+
+    def test_score_key(self):
+        birthday = datetime.datetime(1995, 5, 12)
+        key = score_key("79034852532", "a@b.ru", birthday, 1, "Lewis", "Hamilton")
+        self.assertRegex(key, r"^s2:[A-Za-z0-9+/]{22}$")
+        # email and gender are part of the key, unset and empty fields are the same
+        self.assertNotEqual(key, score_key("79034852532", "c@d.ru", birthday, 1, "Lewis", "Hamilton"))
+        self.assertNotEqual(key, score_key("79034852532", "a@b.ru", birthday, 2, "Lewis", "Hamilton"))
+        self.assertEqual(score_key(phone="79034852532"), score_key("79034852532", "", None, None, "", ""))
+        self.assertNotEqual(score_key(first_name="ab", last_name="c"), score_key(first_name="a", last_name="bc"))
+
+    def test_get_scores_with_unavailable_store(self):
+        with patch.object(MemcacheClient, "cache_get_many", side_effect=ConnectionRefusedError):
+            with patch.object(MemcacheClient, "cache_set_many", side_effect=TimeoutError) as cache_set_many:
+                store = MemcacheClient()
+                self.assertEqual([3.0, 0], get_scores(store, [{"phone": "79034852532", "email": "a@b.c"}, {}]))
+                self.assertEqual(1, cache_set_many.call_count)
+
     @cases([1, ])
     def test_get_interests_with_unavailable_store(self, cid):
         with patch.object(MemcacheClient, "get", side_effect=[ConnectionRefusedError, TimeoutError]) as get:
@@ -76,6 +175,19 @@ class TestScoring(unittest.TestCase):
             store = MemcacheClient()
             self.assertEqual(expected_result, get_interests(store, cid))
 
+    def test_get_interests_many_with_available_store(self):
+        with patch.object(MemcacheClient, "get_many",
+                          return_value={"i:1": json.dumps(["tox", "otus"]), "i:3": ""}) as get_many:
+            store = MemcacheClient()
+            self.assertEqual({1: ["tox", "otus"], 2: [], 3: []}, get_interests_many(store, [1, 2, 3]))
+            self.assertEqual(["i:1", "i:2", "i:3"], list(get_many.call_args.args[0]))
+
+    def test_get_interests_many_with_unavailable_store(self):
+        with patch.object(MemcacheClient, "get_many", side_effect=ConnectionRefusedError):
+            store = MemcacheClient()
+            with self.assertRaises(expected_exception=ConnectionRefusedError):
+                get_interests_many(store, [1, 2])
+
 
 if __name__ == "__main__":
     unittest.main()
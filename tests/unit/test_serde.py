@@ -0,0 +1,113 @@
+import json
+import unittest
+from unittest.mock import patch
+
+import serde
+from scoring import get_interests_many, get_score
+from store import AsyncMemcacheClient, MemcacheClient
+from bench.memcache import MemcacheStub
+from tests.utils import cases
+
+
+class TestCompactSerde(unittest.TestCase):
+    def setUp(self):
+        self.serde = serde.CompactSerde()
+
+    def round_trip(self, value):
+        data, flags = self.serde.serialize(b"key", value)
+        return data, flags, self.serde.deserialize(b"key", data, flags)
+
+    @cases([(0, 2), (3.0, 2), (5.0, 2), (0.5, 2), (1e10, 8), (0.1, 8), (-2.25, 2)])
+    def test_score(self, score, size):
+        data, flags, value = self.round_trip(score)
+        self.assertEqual((serde.FLAG_SCORE, size, float(score)), (flags, len(data), value))
+        self.assertIs(float, type(value))
+
+    @cases([
+        [],
+        ["cars", "pets", "otus"],
+        ["cars", "пиво", "otus", ""],
+        ["x" * 255],
+        ])
+    def test_interests(self, interests):
+        data, flags, value = self.round_trip(interests)
+        self.assertEqual(serde.FLAG_INTERESTS, flags)
+        self.assertEqual(interests, value)
+        self.assertLessEqual(len(data), len(json.dumps(interests)))
+
+    def test_vocabulary_is_one_byte_per_item(self):
+        data, _, _ = self.round_trip(["cars", "pets", "travel", "geek"])
+        self.assertEqual(bytes([serde.VERSION, 0, 1, 2, 9]), data)
+
+    @cases([["x" * 256], ["cars", 1]])
+    def test_interests_not_fitting_fall_back_to_json(self, interests):
+        data, flags, value = self.round_trip(interests)
+        self.assertEqual((0, interests), (flags, json.loads(value)))
+
+    @cases([b'["cars", "pets"]', b"3.0", "text"])
+    def test_legacy_values_are_returned_as_stored(self, legacy):
+        self.assertEqual(legacy, self.serde.deserialize(b"key", legacy, 0))
+
+    def test_unknown_version_is_a_miss(self):
+        with self.assertLogs(level="WARNING"):
+            self.assertIsNone(self.serde.deserialize(b"key", bytes([255, 0]), serde.FLAG_INTERESTS))
+
+    def test_unknown_interest_id_is_a_miss(self):
+        unknown = len(serde.VOCABULARIES[serde.VERSION])
+        for data in (bytes([serde.VERSION, 0, unknown]), bytes([serde.VERSION, serde.ESCAPE, 1, 97, unknown])):
+            with self.assertLogs(level="WARNING"):
+                self.assertIsNone(self.serde.deserialize(b"key", data, serde.FLAG_INTERESTS))
+
+
+class TestSerdeWithMemcache(unittest.TestCase):
+    def test_compact_reads_legacy_values(self):
+        with MemcacheStub() as memcache:
+            legacy = MemcacheClient(timeout=1., servers=[memcache.address])
+            legacy.cache_set_many({"i:1": json.dumps(["cars", "pets"]), "uid:1": 1.5}, 60)
+            compact = MemcacheClient(timeout=1., servers=[memcache.address], serde=serde.CompactSerde())
+            compact.cache_set_many({"i:2": ["otus", "кино"]}, 60)
+            self.assertEqual({1: ["cars", "pets"], 2: ["otus", "кино"], 3: []},
+                             get_interests_many(compact, [1, 2, 3]))
+            self.assertEqual(1.5, float(compact.cache_get("uid:1")))
+            legacy.close()
+            compact.close()
+
+    def test_legacy_reads_compact_values(self):
+        # a worker still on legacy during the switch to compact
+        with MemcacheStub() as memcache:
+            compact = MemcacheClient(timeout=1., servers=[memcache.address], serde=serde.CompactSerde())
+            self.assertEqual(3.0, get_score(compact, phone="79175002040", email="a@b.ru"))
+            compact.cache_set_many({"i:1": ["cars", "pets"]}, 60)
+            legacy = MemcacheClient(timeout=1., servers=[memcache.address])
+            with patch("scoring.compute_score") as compute_score:
+                self.assertEqual(3.0, get_score(legacy, phone="79175002040", email="a@b.ru"))
+            self.assertFalse(compute_score.called)
+            self.assertEqual({1: ["cars", "pets"], 2: []}, get_interests_many(legacy, [1, 2]))
+            legacy.close()
+            compact.close()
+
+    def test_compact_score(self):
+        with MemcacheStub() as memcache:
+            store = MemcacheClient(timeout=1., servers=[memcache.address], serde=serde.CompactSerde())
+            self.assertEqual(3.0, get_score(store, phone="79175002040", email="a@b.ru"))
+            item = next(iter(memcache.data.values()))
+            self.assertEqual((serde.FLAG_SCORE, 2), (item[0], len(item[1])))
+            self.assertEqual(3.0, store.cache_get(next(iter(memcache.data)).decode()))
+            store.close()
+
+
+class TestAsyncSerde(unittest.IsolatedAsyncioTestCase):
+    async def test_clients_share_the_format(self):
+        with MemcacheStub() as memcache:
+            store = AsyncMemcacheClient(timeout=1., servers=[memcache.address], serde=serde.CompactSerde())
+            sync_store = MemcacheClient(timeout=1., servers=[memcache.address], serde=serde.CompactSerde())
+            await store.cache_set_many({"i:1": ["cars"], "uid:1": 4.5}, 60)
+            self.assertEqual({"i:1": ["cars"], "uid:1": 4.5}, sync_store.get_many(["i:1", "uid:1"]))
+            sync_store.cache_set("i:2", ["pets"], 60)
+            self.assertEqual(["pets"], await store.get("i:2"))
+            await store.close()
+            sync_store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,16 @@
+import asyncio
+import socket
+import threading
 import unittest
-from unittest.mock import patch
+from unittest.mock import call, patch
 
 import pymemcache
-from store import MemcacheClient
+from pymemcache.exceptions import MemcacheServerError
+import deadline
+import store
+from store import (AsyncMemcacheClient, AsyncSingleFlight, CircuitBreaker, CircuitOpenError, HashRing, HotKeys,
+                   LocalCache, MemcacheClient, SingleFlight, parse_servers, retry)
+from bench.memcache import MemcacheStub
 
 
 class TestStore(unittest.TestCase):
@@ -66,6 +74,385 @@ class TestStore(unittest.TestCase):
                     self.assertEqual(1, _get.call_count)
                     raise
 
+    def test_get_many_chunks(self):
+        with patch.object(pymemcache.client.base.Client, "get_many",
+                          side_effect=lambda keys: {key: b"1" for key in keys if key != "k3"}) as _get_many:
+            memcl = MemcacheClient(chunk_size=2)
+            self.assertEqual({"k1": b"1", "k2": b"1", "k4": b"1", "k5": b"1"},
+                             memcl.get_many(["k1", "k2", "k3", "k4", "k5"]))
+            self.assertEqual(3, _get_many.call_count)
+
+    def test_sharded_pool(self):
+        with MemcacheStub() as node1, MemcacheStub() as node2:
+            memcl = MemcacheClient(timeout=1., servers=[node1.address, node2.address], pool_size=2)
+            keys = [f"key{i}" for i in range(100)]
+            for key in keys:
+                memcl.cache_set(key, key, 60)
+            self.assertEqual({key: key.encode() for key in keys}, memcl.get_many(keys))
+            self.assertEqual(100, len(node1.data) + len(node2.data))
+            self.assertTrue(node1.data and node2.data)
+            self.assertEqual(b"key7", memcl.get("key7"))
+            self.assertEqual([], memcl.cache_set_many({key: 1.5 for key in keys}, 60))
+            self.assertEqual({key: b"1.5" for key in keys}, memcl.cache_get_many(keys))
+            memcl.close()
+
+    def test_local_cache_in_front_of_memcache(self):
+        with patch.object(pymemcache.client.base.Client, "get", return_value=b"3.0") as _get, \
+                patch.object(pymemcache.client.base.Client, "set", return_value=True) as _set:
+            memcl = MemcacheClient(local_cache=LocalCache(max_entries=10))
+            self.assertEqual(b"3.0", memcl.cache_get("uid:1"))
+            self.assertEqual(b"3.0", memcl.cache_get("uid:1"))
+            self.assertEqual(1, _get.call_count)
+
+            memcl.cache_set("uid:2", 1.5, 60 * 60)
+            self.assertEqual(1.5, memcl.cache_get("uid:2"))
+            self.assertEqual(1, _get.call_count)
+            self.assertEqual(1, _set.call_count)
+            self.assertEqual((2, 1), (memcl.local_cache.hits, memcl.local_cache.misses))
+
+    def test_circuit_breaker_fails_fast(self):
+        with patch.object(pymemcache.client.base.Client, "get", side_effect=ConnectionRefusedError) as _get:
+            memcl = MemcacheClient(breaker=CircuitBreaker(failure_threshold=2, recovery_timeout=60))
+            for _ in range(2):
+                with self.assertRaises(expected_exception=ConnectionRefusedError):
+                    memcl.get('test_key')
+            self.assertEqual(6, _get.call_count)
+            with self.assertRaises(expected_exception=CircuitOpenError):
+                memcl.get('test_key')
+            self.assertEqual(6, _get.call_count)
+
+    def test_write_behind(self):
+        with MemcacheStub() as memcache:
+            memcl = MemcacheClient(timeout=1., servers=[memcache.address], write_behind=1000)
+            self.assertTrue(memcl.cache_set("uid:1", 1.5, 60))
+            self.assertEqual([], memcl.cache_set_many({f"uid:{i}": 3.0 for i in range(2, 300)}, 60))
+            memcl.flush()
+            self.assertEqual(b"1.5", memcl.get("uid:1"))
+            self.assertEqual(299, len(memcl.get_many([f"uid:{i}" for i in range(1, 300)])))
+            memcl.cache_set("uid:300", 5.0, 60)
+            # queued writes are sent on close
+            memcl.close()
+            self.assertEqual(b"5.0", memcache.data[b"uid:300"][1])
+
+    def test_write_behind_counts_dropped_and_failed_writes(self):
+        dropped = store.WRITES_DROPPED.collect().get((), 0)
+        failed = store.WRITES_FAILED.collect().get((), 0)
+        writing, release = threading.Event(), threading.Event()
+
+        def set_many(values, expire, **kwargs):
+            writing.set()
+            release.wait(5)
+            raise MemcacheServerError("out of memory")
+
+        with patch.object(pymemcache.client.base.Client, "set_many", side_effect=set_many):
+            memcl = MemcacheClient(chunk_size=1, write_behind=2)
+            self.assertTrue(memcl.cache_set("k1", 1, 60))
+            writing.wait(5)
+            # k1 is being written, k2 and k3 fill the queue
+            self.assertEqual(["k4"], memcl.cache_set_many({"k2": 2, "k3": 3, "k4": 4}, 60))
+            release.set()
+            memcl.close()
+        self.assertEqual(dropped + 1, store.WRITES_DROPPED.collect()[()])
+        self.assertEqual(failed + 3, store.WRITES_FAILED.collect()[()])
+
+    def test_write_behind_counts_rejected_writes(self):
+        failed = store.WRITES_FAILED.collect().get((), 0)
+
+        def set_many(values, expire, noreply=None, **kwargs):
+            return ["k2"] if noreply is False else []
+
+        with patch.object(pymemcache.client.base.Client, "set_many", side_effect=set_many):
+            memcl = MemcacheClient(write_behind=10)
+            self.assertEqual([], memcl.cache_set_many({"k1": 1, "k2": 2}, 60))
+            memcl.close()
+        self.assertEqual(failed + 1, store.WRITES_FAILED.collect()[()])
+
+    def test_read_cache_remembers_misses(self):
+        with patch.object(pymemcache.client.base.Client, "get_many",
+                          side_effect=lambda keys: {key: b"[]" for key in keys if key != "i:2"}) as _get_many:
+            memcl = MemcacheClient(read_cache=LocalCache(ttl=60), negative_ttl=10)
+            with patch("time.monotonic", return_value=0):
+                self.assertEqual({"i:1": b"[]"}, memcl.get_many(["i:1", "i:2"]))
+                self.assertEqual({"i:1": b"[]"}, memcl.get_many(["i:1", "i:2"]))
+                self.assertIsNone(memcl.get("i:2"))
+            self.assertEqual(1, _get_many.call_count)
+            with patch("time.monotonic", return_value=11):
+                self.assertEqual({"i:1": b"[]"}, memcl.get_many(["i:1", "i:2"]))
+            self.assertEqual([call(["i:2"])], _get_many.call_args_list[1:])
+            memcl.close()
+
+    def test_read_cache_serves_stale_while_refreshing(self):
+        values = {"i:1": b"old"}
+        refreshing, release = threading.Event(), threading.Event()
+
+        def get_many(keys):
+            if refreshing.is_set():
+                release.wait(5)
+            return {key: values[key] for key in keys if key in values}
+
+        with patch.object(pymemcache.client.base.Client, "get_many", side_effect=get_many), \
+                patch("time.monotonic", return_value=0):
+            memcl = MemcacheClient(read_cache=LocalCache(ttl=60, grace=300))
+            self.assertEqual(b"old", memcl.get("i:1"))
+        values["i:1"] = b"new"
+        refreshing.set()
+        with patch.object(pymemcache.client.base.Client, "get_many", side_effect=get_many) as _get_many, \
+                patch("time.monotonic", return_value=100):
+            # the stale value is returned while the refresh is blocked in memcache
+            self.assertEqual(b"old", memcl.get("i:1"))
+            self.assertEqual(b"old", memcl.get("i:1"))
+            release.set()
+            memcl.flush()
+            self.assertEqual(b"new", memcl.get("i:1"))
+            self.assertEqual(1, _get_many.call_count)
+            self.assertEqual(2, memcl.read_cache.stale_hits)
+        with patch.object(pymemcache.client.base.Client, "get_many", side_effect=get_many) as _get_many, \
+                patch("time.monotonic", return_value=500):
+            # past the grace period the lookup waits for memcache again
+            self.assertEqual(b"new", memcl.get("i:1"))
+            self.assertEqual(1, _get_many.call_count)
+        memcl.close()
+
+    def test_request_deadline(self):
+        with patch.object(pymemcache.client.base.Client, "get", side_effect=ConnectionRefusedError) as _get, \
+                patch("random.uniform", return_value=.05):
+            memcl = MemcacheClient()
+            with deadline.scope(deadline.after(.01)), self.assertRaises(expected_exception=ConnectionRefusedError):
+                memcl.get('test_key')
+            # the backoff would outlast the request
+            self.assertEqual(1, _get.call_count)
+            with deadline.scope(deadline.after(0)), self.assertRaises(expected_exception=deadline.DeadlineExceeded):
+                memcl.get('test_key')
+            self.assertEqual(1, _get.call_count)
+
+    def test_metrics(self):
+        lookups = store.MEMCACHE_LOOKUPS.collect()
+        errors = store.MEMCACHE_ERRORS.collect().get(("get",), 0)
+        retries = store.RETRIES.collect().get(("get",), 0)
+        with patch.object(pymemcache.client.base.Client, "get_many",
+                          side_effect=lambda keys: {key: b"1" for key in keys if key != "k3"}):
+            MemcacheClient().get_many(["k1", "k2", "k3"])
+        self.assertEqual(lookups.get(("hit",), 0) + 2, store.MEMCACHE_LOOKUPS.collect()[("hit",)])
+        self.assertEqual(lookups.get(("miss",), 0) + 1, store.MEMCACHE_LOOKUPS.collect()[("miss",)])
+
+        with patch.object(pymemcache.client.base.Client, "get", side_effect=ConnectionRefusedError):
+            with self.assertRaises(expected_exception=ConnectionRefusedError):
+                MemcacheClient(breaker=CircuitBreaker(failure_threshold=10)).get('test_key')
+        self.assertEqual(errors + 1, store.MEMCACHE_ERRORS.collect()[("get",)])
+        self.assertEqual(retries + 2, store.RETRIES.collect()[("get",)])
+
+
+class TestRetry(unittest.TestCase):
+    def test_backoff_is_bounded_by_deadline(self):
+        calls = []
+
+        @retry(ConnectionRefusedError, retries=10, backoff_in_seconds=.01, max_backoff_in_seconds=.02,
+               deadline_in_seconds=.05)
+        def fail():
+            calls.append(1)
+            raise ConnectionRefusedError
+
+        clock = [0.]
+        with patch("random.uniform", side_effect=lambda low, high: high), \
+                patch("time.monotonic", side_effect=lambda: clock[0]), \
+                patch("time.sleep", side_effect=lambda delay: clock.__setitem__(0, clock[0] + delay)) as _sleep:
+            with self.assertRaises(expected_exception=ConnectionRefusedError):
+                fail()
+        self.assertEqual(3, len(calls))
+        self.assertEqual([.02, .02], [call.args[0] for call in _sleep.call_args_list])
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_half_open_close(self):
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=10)
+        with patch("time.monotonic", return_value=0):
+            breaker.on_failure()
+            self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+            breaker.on_failure()
+            self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+        with patch("time.monotonic", return_value=11):
+            breaker.before_call()
+            self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+            breaker.on_failure()
+            self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        with patch("time.monotonic", return_value=22):
+            breaker.before_call()
+            breaker.on_success()
+            self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+            breaker.before_call()
+
+    def test_deadline_during_half_open_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=10)
+        memcl = MemcacheClient(breaker=breaker)
+        with patch("time.monotonic", return_value=0):
+            breaker.on_failure()
+        with patch("time.monotonic", return_value=11), \
+                patch.object(pymemcache.client.base.Client, "get", side_effect=deadline.DeadlineExceeded):
+            with self.assertRaises(deadline.DeadlineExceeded):
+                memcl.get("test_key")
+            self.assertEqual((CircuitBreaker.HALF_OPEN, 1), (breaker.state, breaker.failures))
+        with patch("time.monotonic", return_value=11), \
+                patch.object(pymemcache.client.base.Client, "get", side_effect=KeyError):
+            # the trial slot was given back, and again for errors that say nothing about memcache
+            with self.assertRaises(KeyError):
+                memcl.get("test_key")
+        with patch("time.monotonic", return_value=11), \
+                patch.object(pymemcache.client.base.Client, "get", return_value=b"1"):
+            self.assertEqual(b"1", memcl.get("test_key"))
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        memcl.close()
+
+
+class TestLocalCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LocalCache(max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((1, None, 3), (cache.get("a"), cache.get("b"), cache.get("c")))
+        self.assertEqual(1, cache.evictions)
+
+    def test_memory_bound(self):
+        cache = LocalCache(max_entries=100, max_bytes=1000)
+        for i in range(100):
+            cache.set(f"key{i}", "x" * 100)
+        self.assertLessEqual(cache.bytes, 1000)
+        self.assertEqual(100 - len(cache), cache.evictions)
+
+    def test_ttl(self):
+        cache = LocalCache(ttl=60)
+        with patch("time.monotonic", return_value=0):
+            cache.set("a", 1, 60 * 60)
+            cache.set("b", 2, 10)
+        with patch("time.monotonic", return_value=30):
+            self.assertEqual((1, None), (cache.get("a"), cache.get("b")))
+        with patch("time.monotonic", return_value=61):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, len(cache))
+
+    def test_grace(self):
+        cache = LocalCache(ttl=60, grace=30)
+        with patch("time.monotonic", return_value=0):
+            cache.set("a", 1)
+        with patch("time.monotonic", return_value=70):
+            self.assertEqual((None, (True, 1, False)), (cache.get("a"), cache.lookup("a")))
+        with patch("time.monotonic", return_value=91):
+            self.assertEqual((False, None, False), cache.lookup("a"))
+        self.assertEqual(0, len(cache))
+
+
+class TestHotKeys(unittest.TestCase):
+    def test_top_and_decay(self):
+        hot_keys = HotKeys(max_keys=3, sample=1)
+        for _ in range(4):
+            hot_keys.record(["a", "b"])
+        hot_keys.record(["b", "c"])
+        self.assertEqual(["b", "a", "c"], hot_keys.top())
+        self.assertEqual(["b"], hot_keys.top(1))
+        hot_keys.record(["d"])
+        self.assertCountEqual(["a", "b"], hot_keys.top())
+
+    def test_store_records_lookups(self):
+        with MemcacheStub() as stub:
+            memcl = MemcacheClient(servers=[stub.address], hot_keys=HotKeys(sample=1))
+            memcl.cache_set("s2:1", 1.5, 60)
+            memcl.cache_get("s2:1")
+            memcl.get_many(["i:1", "s2:1"])
+            memcl.close()
+        self.assertEqual(["s2:1", "i:1"], memcl.hot_keys.top())
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_failure_is_shared_and_forgotten(self):
+        flights = SingleFlight("test")
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise ConnectionRefusedError
+
+        for _ in range(2):
+            with self.assertRaises(expected_exception=ConnectionRefusedError):
+                flights.do("key", fail)
+        # a finished call is not reused
+        self.assertEqual(2, len(calls))
+        self.assertEqual(3.0, flights.do("key", lambda: 3.0))
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_execution(self):
+        flights = AsyncSingleFlight("test")
+        calls = []
+
+        async def fetch(value):
+            calls.append(value)
+            await asyncio.sleep(.01)
+            return value
+
+        self.assertEqual([1, 1, 2], await asyncio.gather(flights.do("a", fetch, 1), flights.do("a", fetch, 1),
+                                                         flights.do("b", fetch, 2)))
+        self.assertEqual([1, 2], calls)
+        self.assertEqual(1, await flights.do("a", fetch, 1))
+        self.assertEqual([1, 2, 1], calls)
+
+
+class TestHashRing(unittest.TestCase):
+    def test_adding_node_moves_few_keys(self):
+        keys = [f"uid:{i}" for i in range(10000)]
+        ring = HashRing(["a:1", "b:1", "c:1"])
+        grown = HashRing(["a:1", "b:1", "c:1", "d:1"])
+        moved = sum(ring.get_node(key) != grown.get_node(key) for key in keys)
+        self.assertLess(moved, len(keys) * 0.35)
+        self.assertTrue(all(grown.get_node(key) == "d:1" for key in keys if ring.get_node(key) != grown.get_node(key)))
+
+    def test_parse_servers(self):
+        self.assertEqual([("localhost", 11211), ("10.0.0.2", 11212)], parse_servers("localhost:11211, 10.0.0.2:11212"))
+
+
+class TestAsyncStore(unittest.IsolatedAsyncioTestCase):
+    async def test_cache_set_get(self):
+        with MemcacheStub() as stub:
+            memcl = AsyncMemcacheClient(timeout=1., servers=[stub.address])
+            self.assertTrue(await memcl.cache_set("test_key", 1.5, 60))
+            self.assertEqual(b"1.5", await memcl.cache_get("test_key"))
+            self.assertIsNone(await memcl.get("missing_key"))
+            memcl.chunk_size = 2
+            self.assertEqual({"test_key": b"1.5"}, await memcl.get_many(["k1", "test_key", "k2", "k3", "k4"]))
+            await memcl.close()
+
+    async def test_retry_get(self):
+        with patch("asyncio.open_connection", side_effect=ConnectionRefusedError) as _open, \
+                patch("asyncio.sleep") as _sleep:
+            memcl = AsyncMemcacheClient(timeout=1.)
+            with self.assertRaises(expected_exception=ConnectionRefusedError):
+                await memcl.get('test_key')
+            self.assertEqual(3, _open.call_count)
+            self.assertEqual(2, _sleep.call_count)
+
+    async def test_deadline_is_not_a_memcache_failure(self):
+        # the listening socket never answers
+        with socket.create_server(("localhost", 0)) as silent:
+            memcl = AsyncMemcacheClient(timeout=1., servers=[silent.getsockname()[:2]],
+                                        breaker=CircuitBreaker(failure_threshold=2))
+            errors = store.MEMCACHE_ERRORS.collect().get(("get_many",), 0)
+            for _ in range(3):
+                with deadline.scope(deadline.after(.02)), self.assertRaises(deadline.DeadlineExceeded):
+                    await memcl.get_many(["i:1"])
+            self.assertEqual((CircuitBreaker.CLOSED, 0), (memcl.breaker.state, memcl.breaker.failures))
+            self.assertEqual(errors, store.MEMCACHE_ERRORS.collect().get(("get_many",), 0))
+            # a call timing out on its own still counts
+            memcl.timeout = .02
+            with self.assertRaises(TimeoutError) as raised:
+                await memcl.get_many(["i:1"])
+            self.assertNotIsInstance(raised.exception, deadline.DeadlineExceeded)
+            self.assertEqual(1, memcl.breaker.failures)
+            await memcl.close()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,71 @@
+import io
+import json
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+import api
+import warmup
+from scoring import get_interests, get_score
+from serde import CompactSerde
+from store import HotKeys, MemcacheClient
+from bench.memcache import MemcacheStub
+
+
+class TestWarmup(unittest.TestCase):
+    def test_load_paces_batches(self):
+        store = Mock()
+        store.cache_set_many.return_value = []
+        with patch("time.monotonic", return_value=0), patch("time.sleep") as sleep:
+            self.assertEqual((250, 0), warmup.load(store, ((str(i), i) for i in range(250)), batch_size=100,
+                                                   rate=1000))
+        self.assertEqual([100, 100, 50], [len(c.args[0]) for c in store.cache_set_many.call_args_list])
+        self.assertFalse(store.cache_set_many.call_args.kwargs["noreply"])
+        self.assertEqual([.1, .2], [c.args[0] for c in sleep.call_args_list])
+
+    @unittest.skipIf(warmup.bulk.np is None, "numpy is not installed")
+    def test_load_identities_and_interests(self):
+        identities = io.StringIO("phone,email,gender,birthday\n79175002040,stupnikov@otus.ru,1,01.01.1990\n"
+                                 "79175002040,,,\n")
+        interests = io.StringIO('{"client_id": 1, "interests": ["cars", "pets"]}\n\n')
+        with MemcacheStub() as stub:
+            store = MemcacheClient(servers=[stub.address], serde=CompactSerde())
+            self.assertEqual((1, 0), warmup.load(store, warmup.score_values(identities)))
+            self.assertEqual((1, 0), warmup.load(store, warmup.interest_values(interests, compact=True)))
+            with patch("scoring.compute_score") as compute_score:
+                self.assertEqual(4.5, get_score(store, "79175002040", "stupnikov@otus.ru",
+                                                birthday=api.parse_date("01.01.1990"), gender=1))
+            self.assertFalse(compute_score.called)
+            self.assertEqual(["cars", "pets"], get_interests(store, 1))
+            store.close()
+
+    def test_snapshot_round_trip(self):
+        with MemcacheStub() as stub:
+            service_store = MemcacheClient(servers=[stub.address], serde=CompactSerde(),
+                                           hot_keys=HotKeys(sample=1))
+            service_store.cache_set_many({"s2:a": 1.5, "i:1": ["cars"], "i:2": "[\"pets\"]"}, 60)
+            service_store.get_many(["s2:a", "i:1", "i:2", "i:3"])
+            server = api.ScoringHTTPServer(("localhost", 0), api.MainHTTPHandler, threads=1)
+            server.store = service_store
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                snapshot = io.StringIO()
+                store = MemcacheClient(servers=[stub.address], serde=warmup.RawSerde())
+                self.assertEqual((4, 3), warmup.take_snapshot("http://localhost:%d/" % server.server_address[1],
+                                                              store, snapshot))
+            finally:
+                server.shutdown()
+                server.server_close()
+            keys = ["s2:a", "i:1", "i:2"]
+            saved = store.get_many(keys)
+
+            with stub.lock:
+                stub.data.clear()
+            snapshot.seek(0)
+            self.assertEqual((3, 0), warmup.load(store, warmup.snapshot_values(snapshot)))
+            self.assertEqual(saved, store.get_many(keys))
+            self.assertEqual({"s2:a": 1.5, "i:1": ["cars"], "i:2": b'["pets"]'},
+                             service_store.get_many(keys))
+            store.close()
+            service_store.close()
+        self.assertEqual(3, len([json.loads(line) for line in snapshot.getvalue().splitlines()]))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# usage: python warmup.py load [--identities FILE.csv] [--interests FILE.jsonl] [--snapshot FILE.jsonl]
+#                              [--memcache HOST:PORT,...] [--memcache-format FORMAT] [--rate KEYS_PER_SEC]
+#                              [--batch-size N] [--expire SECONDS]
+#        python warmup.py snapshot --service URL [--limit N] [--memcache HOST:PORT,...] [--output FILE.jsonl]
+#
+# load fills an empty memcache before traffic reaches it:
+#   --identities  CSV of online_score fields (see bulk.py), stored as scores under the keys get_score reads
+#   --interests   JSONL of {"client_id": 1, "interests": ["cars", "pets"]}, stored under interests_key
+#   --snapshot    JSONL written by snapshot, restored byte for byte with the original flags
+# snapshot asks a running service (started with --hot-keys) for the keys it looks up most and saves
+# their current values.
+
+import base64
+import itertools
+import json
+import logging
+from optparse import OptionParser
+import sys
+import time
+import urllib.request
+
+import bulk
+from scoring import interests_key
+from serde import SERDES
+from store import MemcacheClient, parse_servers
+
+
+class RawSerde:
+    # values exactly as stored, (bytes, flags) in both directions
+    def serialize(self, key, value):
+        return value
+
+    def deserialize(self, key, value, flags):
+        return value, flags
+
+
+def batches(items, size: int):
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def score_values(source, chunk_size: int = 100000):
+    if bulk.np is None:
+        raise RuntimeError("scoring identities needs numpy: pip install numpy")
+    for columns in bulk.read_chunks(source, chunk_size):
+        valid, scores, ordinals = bulk.score_columns(columns)
+        yield from bulk.cache_values(columns, valid, scores, ordinals).items()
+
+
+def interest_values(source, compact: bool = False):
+    # the compact serde packs lists itself, legacy readers expect JSON text
+    for line in source:
+        if line.strip():
+            record = json.loads(line)
+            interests = record["interests"]
+            yield interests_key(record["client_id"]), interests if compact else json.dumps(interests)
+
+
+def snapshot_values(source):
+    for line in source:
+        if line.strip():
+            record = json.loads(line)
+            yield record["key"], (base64.b64decode(record["value"]), record["flags"])
+
+
+def load(store, items, batch_size: int = 100, rate: float = 0., expire: int = 60 * 60):
+    # multi-sets of `batch_size` keys, at most `rate` keys a second (0 for no limit);
+    # returns the number of keys sent and of keys memcache did not store
+    started = time.monotonic()
+    sent = failed = 0
+    for batch in batches(items, batch_size):
+        if rate:
+            delay = started + sent / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        # off the request path: wait for the replies to count what memcache refused
+        failed += len(store.cache_set_many(dict(batch), expire, noreply=False))
+        sent += len(batch)
+    return sent, failed
+
+
+def take_snapshot(url: str, store, destination, limit: int = 100000, batch_size: int = 100):
+    # `store` must read with RawSerde; returns the number of hot keys and of the ones found in memcache
+    with urllib.request.urlopen("%s/hotkeys?limit=%d" % (url.rstrip("/"), limit), timeout=10) as response:
+        keys = json.loads(response.read())["keys"]
+    found = 0
+    for batch in batches(keys, batch_size):
+        for key, (value, flags) in store.get_many(batch).items():
+            destination.write(json.dumps({"key": key, "value": base64.b64encode(value).decode('ascii'),
+                                          "flags": flags}) + "\n")
+            found += 1
+    return len(keys), found
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog load|snapshot [options]")
+    op.add_option("--memcache", action="store", default="localhost:11211")
+    op.add_option("--memcache-timeout", action="store", type=float, default=5.)
+    op.add_option("--batch-size", action="store", type=int, default=100, help="keys per multi-set or multi-get")
+    op.add_option("--identities", action="store", default=None, metavar="FILE")
+    op.add_option("--interests", action="store", default=None, metavar="FILE")
+    op.add_option("--snapshot", action="store", default=None, metavar="FILE")
+    op.add_option("--memcache-format", action="store", default="legacy", choices=sorted(SERDES),
+                  help="encoding of the scores and interests written by load, as the service's --memcache-format")
+    op.add_option("--rate", action="store", type=float, default=0., help="max keys written a second, 0 for no limit")
+    op.add_option("--expire", action="store", type=int, default=60 * 60, help="seconds the loaded keys live")
+    op.add_option("--service", action="store", default="http://localhost:8080", help="service to take a snapshot of")
+    op.add_option("--limit", action="store", type=int, default=100000, help="max hot keys in a snapshot")
+    op.add_option("-o", "--output", action="store", default=None, help="snapshot file, stdout by default")
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    if args not in (["load"], ["snapshot"]):
+        op.error("expected one command: load or snapshot")
+    servers = parse_servers(opts.memcache)
+
+    if args == ["snapshot"]:
+        store = MemcacheClient(timeout=opts.memcache_timeout, servers=servers, chunk_size=opts.batch_size,
+                               serde=RawSerde())
+        destination = open(opts.output, "w") if opts.output else sys.stdout
+        try:
+            keys, found = take_snapshot(opts.service, store, destination, opts.limit, opts.batch_size)
+        finally:
+            store.close()
+            destination.flush()
+        logging.info("Saved %s of %s hot keys", found, keys)
+    else:
+        sources = []
+        if opts.identities:
+            sources.append(("identities", SERDES[opts.memcache_format](), score_values, opts.identities))
+        if opts.interests:
+            sources.append(("interests", SERDES[opts.memcache_format](),
+                            lambda f: interest_values(f, opts.memcache_format == "compact"), opts.interests))
+        if opts.snapshot:
+            sources.append(("snapshot", RawSerde(), snapshot_values, opts.snapshot))
+        if not sources:
+            op.error("nothing to load: give --identities, --interests or --snapshot")
+        for name, serde, read, filename in sources:
+            store = MemcacheClient(timeout=opts.memcache_timeout, servers=servers, chunk_size=opts.batch_size,
+                                   serde=serde)
+            started = time.monotonic()
+            with open(filename, newline="", encoding="utf-8") as source:
+                try:
+                    sent, failed = load(store, read(source), opts.batch_size, opts.rate, opts.expire)
+                finally:
+                    store.close()
+            logging.info("Loaded %s keys from %s %s in %.1f s, %s not stored", sent, name, filename,
+                         time.monotonic() - started, failed)